@@ -0,0 +1,111 @@
+"""
+cache_bench.py: memory per cached RRset and lookup speed of the record
+cache, next to a plain dict of dnspython RRsets and to the cache's
+previous representation
+
+    python cache_bench.py [owner names]
+
+Every owner name gets an A, AAAA, MX and CNAME RRset, as answers from a
+server would have them: each with its own copy of the owner name.
+"""
+
+from collections import OrderedDict
+import sys
+import time
+import tracemalloc
+import dns.name
+import dns.rdatatype
+import dns.rrset
+from rrcache import RecordCache
+
+
+def sample(owners: int) -> list:
+    """
+    4 RRsets for each of owners names
+    """
+    rrsets = []
+    for i in range(owners):
+        owner = f"host{i}.zone{i % 1000}.example."
+        rrsets.append(dns.rrset.from_text(owner, 300, "IN", "A",
+                                          f"10.{i % 256}.{i // 256 % 256}.1",
+                                          f"10.{i % 256}.{i // 256 % 256}.2"))
+        rrsets.append(dns.rrset.from_text(owner, 300, "IN", "AAAA",
+                                          f"2001:db8::{i % 65536:x}"))
+        rrsets.append(dns.rrset.from_text(owner, 300, "IN", "MX",
+                                          f"10 mail.zone{i % 1000}.example."))
+        rrsets.append(dns.rrset.from_text("www." + owner, 300, "IN", "CNAME",
+                                          owner))
+    return rrsets
+
+
+def plain_dict(rrsets) -> dict:
+    """
+    RRset objects keyed by (name, rdtype, rdclass)
+    """
+    return {(rrset.name, rrset.rdtype, rrset.rdclass):
+            (time.monotonic() + rrset.ttl, rrset) for rrset in rrsets}
+
+
+def rrset_size(rrset) -> int:
+    """
+    the budget estimate the previous cache charged for an RRset
+    """
+    return (256 + len(rrset.name.to_wire())
+            + sum(64 + len(rdata.to_wire()) for rdata in rrset))
+
+
+def previous_cache(rrsets):
+    """
+    the record cache before RRsets were packed: an OrderedDict of
+    (expires, RRset, budget estimate) keyed by (name, rdtype, rdclass),
+    each RRset with its own owner name; return (it, its budget estimate)
+    """
+    entries = OrderedDict()
+    for rrset in rrsets:
+        entries[(rrset.name, rrset.rdtype, rrset.rdclass)] = (
+            time.monotonic() + rrset.ttl, rrset, rrset_size(rrset))
+    return entries, sum(entry[2] for entry in entries.values())
+
+
+def record_cache(rrsets) -> RecordCache:
+    cache = RecordCache(max_bytes=1 << 40)
+    for rrset in rrsets:
+        cache.put(rrset)
+    return cache
+
+
+def measure(store, owners: int):
+    """
+    return (bytes per RRset, the filled store): the memory the store holds
+    on to once the RRsets it was given are gone
+    """
+    tracemalloc.start()
+    filled = store(sample(owners))
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return used / (4 * owners), filled
+
+
+def main():
+    owners = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    print(f"{4 * owners} RRsets")
+    per_rrset, _ = measure(plain_dict, owners)
+    print(f"dict of dnspython RRsets: {per_rrset:.0f} bytes per RRset")
+    per_rrset, (_, estimate) = measure(previous_cache, owners)
+    print(f"previous RecordCache:     {per_rrset:.0f} bytes per RRset, "
+          f"budget estimate {estimate / (4 * owners):.0f}")
+    per_rrset, cache = measure(record_cache, owners)
+    print(f"RecordCache:              {per_rrset:.0f} bytes per RRset, "
+          f"budget estimate {cache.size / (4 * owners):.0f}")
+
+    names = [dns.name.from_text(f"www.host{i}.zone{i % 1000}.example.")
+             for i in range(owners)]
+    start = time.perf_counter()
+    for name in names:
+        cache.get_answer(name, dns.rdatatype.A)
+    seconds = time.perf_counter() - start
+    print(f"get_answer (CNAME + A): {seconds / owners * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
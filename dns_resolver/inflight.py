@@ -0,0 +1,65 @@
+"""
+inflight.py: coalesce identical calls that are in flight at the same time
+"""
+
+import threading
+
+
+class Call:
+    """
+    one call in flight: its result or error once the event is set
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    run one call per key at a time. A caller asking for a key that is
+    already in flight waits for the first caller's result, or error,
+    instead of doing the same work again. Results are shared, so they
+    must not be modified.
+    """
+
+    def __init__(self):
+        self.stats = {"calls": 0, "deduplicated": 0}
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._calls)
+
+    def do(self, key, function, timeout: float = None):
+        """
+        return function(), or the result of the call in flight for key.
+        Raises TimeoutError if that call is not done within timeout.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Call()
+                self.stats["calls"] += 1
+            else:
+                self.stats["deduplicated"] += 1
+
+        if leader:
+            try:
+                call.result = function()
+            except Exception as error:
+                call.error = error
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.event.set()
+            return call.result
+
+        if not call.event.wait(timeout):
+            raise TimeoutError
+        if call.error is not None:
+            raise call.error
+        return call.result
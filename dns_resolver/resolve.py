@@ -2,18 +2,31 @@
 resolve.py: a recursive resolver built using dnspython
 """
 
-from multiprocessing import Process, Queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import json
+import queue
+import sys
 import time
 import argparse
-import random
+import dns.exception
+import dns.flags
 import dns.message
 import dns.name
 import dns.query
+import dns.rcode
 import dns.rdata
 import dns.rdataclass
 import dns.rdatatype
 import dns.rdtypes
 import dns.resolver
+import threading
+from rrcache import NODATA, NXDOMAIN, DelegationCache, RecordCache
+from servers import ServerStats, TCPConnections
+from inflight import SingleFlight
+from server import DNSServer
+import snapshot
 
 
 FORMATS = (
@@ -23,6 +36,11 @@ FORMATS = (
     ("MX", "{name} mail is handled by {preference} {exchange}"),
 )
 
+QUERY_TIMEOUT = 3  # seconds one whole resolution may take
+UDP_TIMEOUT = 3  # seconds to wait for one server to answer
+EDNS_PAYLOAD = 1232  # UDP payload we advertise, avoids IP fragmentation
+MAX_WORKERS = 64  # resolutions the engine runs at the same time
+
 # current as of 19 October 2020
 ROOT_SERVERS = (
     "198.41.0.4",
@@ -41,22 +59,35 @@ ROOT_SERVERS = (
 )
 
 
-def collect_results(name: str) -> dict:
+def start_lookups(name: str) -> dict:
+    """
+    start the CNAME, A, AAAA and MX lookups for name on the engine at once,
+    return {rtype: Future}
+    """
+    target_name = dns.name.from_text(name)
+    return {rtype: lookup_async(target_name, dns.rdatatype.from_text(rtype))
+            for rtype, _ in FORMATS}
+
+
+def collect_results(name: str, lookups: dict = None) -> dict:
     """
     This function parses final answers into the proper data structure that
-    print_results requires. The main work is done within the `lookup` function.
+    print_results requires. The main work is done within the `lookup` function,
+    the four lookups run concurrently (see start_lookups). Do not call this
+    from an engine thread, it waits for other engine threads.
     """
     full_response = {}
-    target_name = dns.name.from_text(name)
+    if lookups is None:
+        lookups = start_lookups(name)
     try:
         # lookup CNAME
-        response = lookup(target_name, dns.rdatatype.CNAME)
+        response = lookups["CNAME"].result()
         cnames = []
         for answers in response.answer:
             for answer in answers:
                 cnames.append({"name": answer, "alias": name})
         # lookup A
-        response = lookup(target_name, dns.rdatatype.A)
+        response = lookups["A"].result()
         arecords = []
         for answers in response.answer:
             a_name = answers.name
@@ -64,7 +95,7 @@ def collect_results(name: str) -> dict:
                 if answer.rdtype == 1:  # A record
                     arecords.append({"name": a_name, "address": str(answer)})
         # lookup AAAA
-        response = lookup(target_name, dns.rdatatype.AAAA)
+        response = lookups["AAAA"].result()
         aaaarecords = []
         for answers in response.answer:
             aaaa_name = answers.name
@@ -73,7 +104,7 @@ def collect_results(name: str) -> dict:
                     aaaarecords.append({"name": aaaa_name,
                                         "address": str(answer)})
         # lookup MX
-        response = lookup(target_name, dns.rdatatype.MX)
+        response = lookups["MX"].result()
         mxrecords = []
         for answers in response.answer:
             mx_name = answers.name
@@ -100,83 +131,328 @@ def collect_results(name: str) -> dict:
     return full_response
 
 
-def pick_random() -> str:
-    """ "
-    pick a random root server
+# Where resolutions start, and the port every nameserver is asked on;
+# see set_root_hints
+root_servers = ROOT_SERVERS
+upstream_port = 53
+
+# Global Cache of RRsets and negative answers
+cache = RecordCache()
+# Zone cuts and glue learnt from referrals
+delegations = DelegationCache()
+# Smoothed RTT and backoff state of every nameserver we talked to
+servers = ServerStats()
+# Connections for answers too big for UDP, reused between queries
+tcp_connections = TCPConnections()
+# UDP payload size advertised with EDNS0, 0 to send plain DNS queries
+edns_payload = EDNS_PAYLOAD
+# Upstream queries in flight, shared by identical concurrent queries
+inflight = SingleFlight()
+
+# Counters of what the resolver sent upstream
+stats = {"upstream_queries": 0, "resolutions": 0, "retries": 0, "udp": 0,
+         "truncated": 0, "tcp": 0, "edns_fallback": 0, "refreshes": 0,
+         "stale_answers": 0}
+stats_lock = threading.Lock()
+
+
+def count(stat: str, n: int = 1) -> None:
+    """
+    add n to one of the resolver's stats
+    """
+    with stats_lock:
+        stats[stat] = stats.get(stat, 0) + n
+
+
+def cname_chain(response: dns.message.Message, target_name: dns.name.Name,
+                qtype, zone: dns.name.Name = dns.name.root):
+    """
+    return the names from target_name along the CNAMEs in the answer
+    section, the last one is the canonical name. The servers of zone are
+    only trusted for names in it, so the chain stops at the first name
+    outside zone. A CNAME query is answered by the CNAME itself and is not
+    followed (RFC 1034 section 4.3.2).
+    """
+    names = [target_name]
+    if qtype == dns.rdatatype.CNAME:
+        return names
+    while len(names) < 16 and names[-1].is_subdomain(zone):  # bounds loops
+        cname = response.get_rrset(response.answer, names[-1],
+                                   dns.rdataclass.IN, dns.rdatatype.CNAME)
+        if cname is None:
+            break
+        names.append(cname[0].target)
+    return names
+
+
+def is_nodata(response: dns.message.Message) -> bool:
+    """
+    an empty NOERROR answer with the zone's SOA in the authority section
+    """
+    return (response.rcode() == dns.rcode.NOERROR and not response.answer
+            and any(rrset.rdtype == dns.rdatatype.SOA
+                    for rrset in response.authority))
+
+
+def chain_rrsets(response: dns.message.Message, names,
+                 zone: dns.name.Name) -> list:
     """
-    return random.choice(ROOT_SERVERS)
+    the answer RRsets owned by names, a CNAME chain, that the servers of
+    zone may answer for: out-of-chain and out-of-bailiwick records are
+    left out
+    """
+    return [rrset for rrset in response.answer
+            if rrset.name in names and rrset.name.is_subdomain(zone)]
 
 
-# Global Cache
-cache = {}
+def cache_response(response: dns.message.Message,
+                   target_name: dns.name.Name, qtype,
+                   zone: dns.name.Name = dns.name.root) -> None:
+    """
+    store the answer RRsets on the CNAME chain from target_name that the
+    servers of zone, which sent response, are authoritative for, and
+    NXDOMAIN or NODATA answers for their negative TTL
+    """
+    names = cname_chain(response, target_name, qtype, zone)
+    for rrset in chain_rrsets(response, names, zone):
+        cache.put(rrset)
+    soa = next((rrset for rrset in response.authority
+                if rrset.rdtype == dns.rdatatype.SOA), None)
+    final = names[-1]
+    if soa is None or not final.is_subdomain(zone):
+        return
+    if response.rcode() == dns.rcode.NXDOMAIN:
+        cache.put_negative(final, qtype, NXDOMAIN, soa)
+    elif response.get_rrset(response.answer, final, dns.rdataclass.IN,
+                            qtype) is None:
+        cache.put_negative(final, qtype, NODATA, soa)
+
+
+def cached_response(target_name: dns.name.Name,
+                    qtype) -> dns.message.Message:
+    """
+    build a response from the cache, or return None on a miss
+    """
+    found = cache.get_answer(target_name, qtype)
+    if found is None:
+        return None
+    rcode, answer, authority = found
+    return answer_message(target_name, qtype, rcode, answer, authority)
+
+
+def answer_message(target_name: dns.name.Name, qtype, rcode, answer,
+                   authority=()) -> dns.message.Message:
+    """
+    a new response to target_name/qtype with the given sections
+    """
+    response = dns.message.make_response(
+        dns.message.make_query(target_name, qtype))
+    response.set_rcode(rcode)
+    response.answer = list(answer)
+    response.authority = list(authority)
+    return response
+
+
+def referral(response: dns.message.Message, target_name: dns.name.Name,
+             zone: dns.name.Name):
+    """
+    return (NS RRset, glue RRsets) if response delegates target_name to a
+    zone below zone, else None. Glue for names outside the new zone's
+    nameserver set is ignored.
+    """
+    for rrset in response.authority:
+        if (rrset.rdtype == dns.rdatatype.NS
+                and target_name.is_subdomain(rrset.name)
+                and rrset.name.is_subdomain(zone) and rrset.name != zone):
+            ns_names = {rdata.target for rdata in rrset}
+            glue = [glue_rrset for glue_rrset in response.additional
+                    if glue_rrset.name in ns_names
+                    and glue_rrset.rdtype in (dns.rdatatype.A,
+                                              dns.rdatatype.AAAA)]
+            return rrset, glue
+    return None
+
+
+def nameserver_addresses(ns_names, deadline: float,
+                         resolving=frozenset()) -> list:
+    """
+    resolve the addresses of the first of ns_names (an unglued delegation)
+    that has any. NS names in resolving, those this resolution is already
+    looking up, are skipped: a zone whose nameservers can only be found
+    through itself would loop.
+    """
+    for ns_name in ns_names:
+        if ns_name in resolving:
+            continue
+        ns_response = resolve_cached(ns_name, dns.rdatatype.A, deadline,
+                                     resolving=resolving | {ns_name})
+        if ns_response is None:
+            continue
+        addresses = [rdata.address for rrset in ns_response.answer
+                     if rrset.rdtype == dns.rdatatype.A for rdata in rrset]
+        if addresses:
+            return addresses
+    return []
+
+
+def exchange(query: dns.message.Message, server: str, timeout: float,
+             deadline: float) -> dns.message.Message:
+    """
+    send query to server over UDP, waiting timeout seconds. Ask again over
+    TCP if the answer was truncated, and without EDNS if the server does
+    not support it; such a server is remembered and gets plain queries
+    from then on.
+    """
+    if query.edns >= 0 and not servers.edns(server):
+        return exchange(plain_query(query), server, timeout, deadline)
+    count("udp")
+    response = dns.query.udp(query, server, timeout, port=upstream_port)
+    if response.flags & dns.flags.TC:
+        count("truncated")
+        count("tcp")
+        response = tcp_connections.query(
+            query, server, min(UDP_TIMEOUT, deadline - time.monotonic()),
+            upstream_port)
+    elif (query.edns >= 0 and response.rcode() in (dns.rcode.FORMERR,
+                                                   dns.rcode.NOTIMP)):
+        # RFC 6891 section 7: a server that predates EDNS
+        count("edns_fallback")
+        servers.no_edns(server)
+        return exchange(plain_query(query), server, timeout, deadline)
+    return response
+
+
+def plain_query(query: dns.message.Message) -> dns.message.Message:
+    """
+    query without EDNS, keeping its id
+    """
+    plain = dns.message.make_query(query.question[0].name,
+                                   query.question[0].rdtype)
+    plain.id = query.id
+    return plain
+
+
+def query_servers(query: dns.message.Message, addresses,
+                  deadline: float) -> dns.message.Message:
+    """
+    send query to the fastest of addresses, the nameservers of one zone.
+    A server that times out, cannot be reached or answers SERVFAIL or
+    REFUSED is backed off and the query goes to a different one, until
+    all were tried twice or deadline passes (dns.exception.Timeout).
+    """
+    tried = set()
+    for attempt in range(2 * len(addresses)):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        server = servers.select(addresses, tried)
+        if server is None:  # every server failed once, go round again
+            tried.clear()
+            server = servers.select(addresses)
+        tried.add(server)
+        if attempt:
+            count("retries")
+        count("upstream_queries")
+        sent = time.monotonic()
+        try:
+            response = exchange(
+                query, server,
+                min(servers.timeout(server), UDP_TIMEOUT, remaining),
+                deadline)
+        except (dns.exception.Timeout, dns.exception.FormError,
+                dns.query.BadResponse, EOFError, OSError):
+            servers.failure(server)
+            continue
+        if response.rcode() in (dns.rcode.SERVFAIL, dns.rcode.REFUSED):
+            servers.failure(server)
+            continue
+        servers.success(server, time.monotonic() - sent)
+        return response
+    raise dns.exception.Timeout
+
+
+def query_zone(target_name: dns.name.Name, qtype, addresses,
+               zone: dns.name.Name, deadline: float) -> dns.message.Message:
+    """
+    ask the nameservers of zone, at addresses, for target_name/qtype. The
+    same question to the same zone from another thread is not sent again:
+    this waits for that query's response instead.
+    """
+    outbound_query = dns.message.make_query(
+        target_name, qtype, use_edns=0 if edns_payload else False,
+        payload=edns_payload)
+    try:
+        return inflight.do(
+            (zone, target_name, qtype),
+            lambda: query_servers(outbound_query, addresses, deadline),
+            deadline - time.monotonic())
+    except TimeoutError as error:
+        raise dns.exception.Timeout from error
 
 
 def lookup_helper(
-    target_name: dns.name.Name, qtype: dns.rdata.Rdata, server: str
+    target_name: dns.name.Name, qtype: dns.rdata.Rdata, addresses,
+    deadline: float = None, zone: dns.name.Name = dns.name.root,
+    resolving=frozenset()
 ) -> dns.message.Message:
     """ "
-    helper method asks the root servers
-    and recurses to find the proper answer.
+    helper method asks the best of addresses, the nameservers for zone,
+    and recurses down the referrals to find the proper answer.
+    resolving holds the NS names whose addresses this resolution is
+    looking up (see nameserver_addresses).
+    Raises dns.exception.Timeout once time.monotonic() passes deadline.
     """
+    if deadline is None:
+        deadline = time.monotonic() + QUERY_TIMEOUT
 
-    labels = target_name.labels
-    for i in range(len(labels)):
-        subdomain = dns.name.Name(labels[i:])
-        cache_key = (str(subdomain), qtype)
-        if cache_key in cache:
-            #print(f"Cache hit for {cache_key}")
-            return cache[cache_key]
-
-    outbound_query = dns.message.make_query(target_name, qtype)
     try:
-        response = dns.query.udp(outbound_query, server, 3)
-        if response.answer:
-            # Cache the answer for the current target_name (full domain)
-            cache_key = (str(target_name), qtype)
-            cache[cache_key] = response
-            # test caching
-            # print(f"Added to cache: {cache_key}")
-
-            # Cache intermediate results for each label level
-            for i in range(len(labels)):
-                subdomain = dns.name.Name(labels[i:])
-                subdomain_key = (str(subdomain), qtype)
-                if subdomain_key not in cache:
-                    cache[subdomain_key] = response
-                    # test caching
-                    # print(f"Added intermediate result
-                    # to cache: {subdomain_key}")
-
-            # handle CNAME in record
-            for answer_section in response.answer:
-                for record in answer_section:
-                    if record.rdtype == dns.rdatatype.CNAME:
-                        canonical_name = str(record.target)
-                        return lookup_helper(
-                            dns.name.from_text(canonical_name),
-                            dns.rdatatype.A,
-                            pick_random(),
-                        )
+        response = query_zone(target_name, qtype, addresses, zone, deadline)
+        if (response.answer or response.rcode() == dns.rcode.NXDOMAIN
+                or is_nodata(response)):
+            cache_response(response, target_name, qtype, zone)
+
+            # handle CNAME in record: chase the canonical name when the
+            # server did not include its records, or is not authoritative
+            # for it
+            names = cname_chain(response, target_name, qtype, zone)
+            final = names[-1]
+            answer = chain_rrsets(response, names, zone)
+            if final != target_name and (
+                    not final.is_subdomain(zone)
+                    or (response.rcode() == dns.rcode.NOERROR
+                        and response.get_rrset(response.answer, final,
+                                               dns.rdataclass.IN,
+                                               qtype) is None)):
+                chased = resolve_cached(final, qtype, deadline,
+                                        resolving=resolving)
+                if chased is None:
+                    return None
+                # response may be shared with coalesced queries, build a
+                # new one rather than extend it
+                return answer_message(target_name, qtype, chased.rcode(),
+                                      answer + chased.answer,
+                                      chased.authority)
+            if len(answer) != len(response.answer):
+                return answer_message(target_name, qtype, response.rcode(),
+                                      answer, response.authority)
             return response
-        elif response.additional:
-            for additional in response.additional:
-                for item in additional:
-                    if item.rdtype == dns.rdatatype.A:
-                        return lookup_helper(target_name, qtype, str(item))
-        # handle unglued nameserver
-        elif response.authority:
-            for authority in response.authority:
-                for ns_record in authority:
-                    if ns_record.rdtype == dns.rdatatype.NS:
-                        ns_name = str(ns_record.target)
-                        # resolve ip address
-                        ns_response = lookup_helper(
-                            dns.name.from_text(ns_name),
-                            dns.rdatatype.A, pick_random()
-                        )
-                        if ns_response and ns_response.answer:
-                            next_server_ip = str(ns_response.answer[0][0])
-                            return lookup_helper(target_name, qtype, next_server_ip)
+
+        delegation = referral(response, target_name, zone)
+        if delegation is not None:
+            ns_rrset, glue = delegation
+            delegations.put(ns_rrset, glue)
+            addresses = [rdata.address for rrset in glue
+                         if rrset.rdtype == dns.rdatatype.A
+                         for rdata in rrset]
+            if not addresses:
+                # handle unglued nameserver: resolve its address
+                addresses = nameserver_addresses(
+                    [rdata.target for rdata in ns_rrset], deadline,
+                    resolving)
+            if not addresses:  # a delegation we cannot follow
+                return None
+            return lookup_helper(target_name, qtype, addresses,
+                                 deadline, ns_rrset.name, resolving)
     except dns.exception.Timeout:
         print("Error querying server from inner")
         return None
@@ -184,56 +460,122 @@ def lookup_helper(
     return response
 
 
-def process_lookup(
-    target_name: dns.name.Name, qtype: dns.rdata.Rdata, result_queue: Queue
-):
+def resolve_cached(target_name: dns.name.Name, qtype: dns.rdata.Rdata,
+                   deadline: float, use_cache: bool = True,
+                   resolving=frozenset()) -> dns.message.Message:
+    """
+    answer from the cache, or resolve starting at the closest zone cut
+    we know nameservers for, the root if there is none
     """
-    A wrapper function to run the lookup_helper in a separate process
+    if use_cache:
+        cached = cached_response(target_name, qtype)
+        if cached is not None:
+            return cached
+    count("resolutions")
+    closest = delegations.closest(target_name, cache)
+    if closest is None:
+        return lookup_helper(target_name, qtype, root_servers, deadline,
+                             resolving=resolving)
+    zone, addresses = closest
+    return lookup_helper(target_name, qtype, addresses, deadline, zone,
+                         resolving)
+
+
+def lookup(target_name: dns.name.Name, qtype: dns.rdata.Rdata,
+           timeout: float = QUERY_TIMEOUT) -> dns.message.Message:
+    """
+    This function uses a recursive resolver to find the relevant answer to the
+    query. It runs in the calling thread and gives up after timeout seconds.
     """
+
+    start = time.monotonic()
     try:
-        response = lookup_helper(target_name, qtype, pick_random())
-        result_queue.put(response)  # Put the result in the queue
+        response = resolve_cached(target_name, qtype, start + timeout)
     except dns.exception.Timeout:
-        result_queue.put(None)  # In case of timeout
+        response = None
+    if response is None:
+        response = stale_response(target_name, qtype)
+    if response is None:
+        print(f"Time out: {time.monotonic() - start}")
+    return response
 
 
-def lookup(target_name: dns.name.Name, qtype: dns.rdata.Rdata) -> dns.message.Message:
+def stale_response(target_name: dns.name.Name,
+                   qtype) -> dns.message.Message:
     """
-    This function uses a recursive resolver to find the relevant answer to the
-    query.
+    RFC 8767: when the resolution failed, answer from cache entries that
+    expired less than cache.stale_window ago, or return None
     """
+    found = cache.get_answer(target_name, qtype, stale=True)
+    if found is None:
+        return None
+    count("stale_answers")
+    rcode, answer, authority = found
+    return answer_message(target_name, qtype, rcode, answer, authority)
 
-    # Check if the result is already in the cache
-    cache_key = (str(target_name), qtype)
-    if cache_key in cache:
-        # test caching
-        # print(f"Cache hit for {cache_key}")
-        return cache[cache_key]  # Return cached result if found
 
-    start = time.time()
-    result = Queue()  # Create a Queue to get the result from the process
-    p = Process(
-        target=process_lookup, args=(target_name, qtype, result), name="Process_lookup"
-    )
+def refresh(target_name: dns.name.Name, qtype) -> None:
+    """
+    resolve target_name/qtype again, bypassing the cache, to replace the
+    entry before it expires
+    """
+    count("refreshes")
+    try:
+        resolve_cached(target_name, qtype, time.monotonic() + QUERY_TIMEOUT,
+                       use_cache=False)
+    except dns.exception.Timeout:
+        pass
 
-    p.start()  # Start the process
 
-    p.join(timeout=3)  # Wait for the process to complete with a timeout of 3 seconds
-    end = time.time()
-    elapsed_time = end - start
-    if p.is_alive():
-        p.terminate()  # Terminate the process if it's still running
-        p.join()  # Ensure the process is terminated
-        print(f"Time out: {elapsed_time}")
-        return None
-    else:
-        if not result.empty():
-            response = result.get()
-            # Store the response in the cache before returning it
-            cache[cache_key] = response
-            return response
-        else:
-            return None
+def prefetch(target_name: dns.name.Name, qtype, _rdclass) -> None:
+    """
+    called by the cache for a popular entry about to expire: refresh it on
+    the engine's thread pool, so its clients keep getting cache hits
+    """
+    try:
+        executor.submit(refresh, target_name, qtype)
+    except RuntimeError:  # the pool is shut down, we are exiting
+        pass
+
+
+cache.prefetch = prefetch
+
+
+# Threads that run lookups for lookup_async, shared by every caller so the
+# cache above is shared too
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS,
+                              thread_name_prefix="lookup")
+
+
+def lookup_async(target_name: dns.name.Name, qtype: dns.rdata.Rdata,
+                 timeout: float = QUERY_TIMEOUT):
+    """
+    run lookup on the engine's thread pool, return a
+    concurrent.futures.Future of its result
+    """
+    return executor.submit(lookup, target_name, qtype, timeout)
+
+
+def set_root_hints(addresses, port: int = 53) -> None:
+    """
+    start resolutions at the root servers at addresses instead of the
+    real ones, and ask every nameserver on port, e.g. to resolve against
+    simulator.py
+    """
+    global root_servers, upstream_port
+    root_servers = tuple(addresses)
+    upstream_port = port
+
+
+def set_concurrency(workers: int) -> None:
+    """
+    let at most workers lookups run at the same time
+    """
+    global executor
+    old_executor = executor
+    executor = ThreadPoolExecutor(max_workers=workers,
+                                  thread_name_prefix="lookup")
+    old_executor.shutdown(wait=False)
 
 
 def print_results(results: dict) -> None:
@@ -261,23 +603,272 @@ def caching(my_list: list) -> list:
     return unique
 
 
+def json_record(name: str, lookups: dict) -> dict:
+    """
+    the results of finished lookups for name, ready for json.dumps, with
+    the rcode of its A lookup so that a name that does not exist
+    (NXDOMAIN) can be told from one with no records (NOERROR)
+    """
+    record = {"name": name}
+    if lookups is None:
+        record["error"] = "invalid name"
+        return record
+    results = collect_results(name, lookups)
+    record.update(results)
+    if len(results) < len(FORMATS):
+        record["error"] = "timeout"
+    else:
+        record["rcode"] = dns.rcode.to_text(lookups["A"].result().rcode())
+    return record
+
+
+def resolve_stream(lines, concurrency: int, out=sys.stdout,
+                   report_interval: float = 10) -> int:
+    """
+    look up every name in lines (an iterable, e.g. a file) with at most
+    concurrency names in flight, writing a JSON line to out for each one
+    as soon as it is done, so results come out of order. Every
+    report_interval seconds (never if 0) progress goes to stderr. Memory
+    stays bounded however long lines is; returns the number of names.
+    """
+    done = queue.Queue()
+    lock = threading.Lock()
+    remaining = {}  # name number -> lookups not finished yet
+    in_flight = 0
+    finished = failed = 0
+    start = last_report = time.monotonic()
+
+    def lookup_done(number, name, lookups):
+        with lock:
+            remaining[number] -= 1
+            if remaining[number]:
+                return
+            del remaining[number]
+        done.put((name, lookups))
+
+    def emit(block):
+        nonlocal in_flight, finished, failed, last_report
+        try:
+            name, lookups = done.get(block)
+        except queue.Empty:
+            return False
+        in_flight -= 1
+        finished += 1
+        record = json_record(name, lookups)
+        failed += "error" in record
+        out.write(json.dumps(record, default=str) + "\n")
+        now = time.monotonic()
+        if report_interval and now - last_report >= report_interval:
+            out.flush()
+            print(f"{finished} names, {finished / (now - start):.0f} "
+                  f"names/sec, {in_flight} in flight, {failed} failed",
+                  file=sys.stderr, flush=True)
+            last_report = now
+        return True
+
+    for number, line in enumerate(lines):
+        name = line.strip()
+        if not name or name.startswith("#"):
+            continue
+        while in_flight >= concurrency:
+            emit(True)
+        while emit(False):
+            pass
+        in_flight += 1
+        try:
+            lookups = start_lookups(name)
+        except dns.exception.DNSException:
+            done.put((name, None))
+            continue
+        with lock:
+            remaining[number] = len(lookups)
+        for future in lookups.values():
+            future.add_done_callback(
+                lambda _, number=number, name=name, lookups=lookups:
+                lookup_done(number, name, lookups))
+    while in_flight:
+        emit(True)
+    out.flush()
+    return finished
+
+
+def load_snapshot(path: str) -> int:
+    """
+    warm the caches from the snapshot at path, if there is one
+    """
+    try:
+        return snapshot.load(path, cache, delegations)
+    except FileNotFoundError:
+        return 0
+    except OSError as error:
+        print(f"Cannot load cache snapshot: {error}")
+        return 0
+
+
+def save_snapshot(path: str) -> None:
+    """
+    save the caches to path for the next run
+    """
+    try:
+        snapshot.save(path, cache, delegations)
+    except OSError as error:
+        print(f"Cannot save cache snapshot: {error}")
+
+
+def serve(program_args) -> None:
+    """
+    answer DNS queries from the cache and the recursion until interrupted
+    """
+    try:
+        dns_server = DNSServer(cached_response, lookup_async,
+                               program_args.listen, program_args.port,
+                               program_args.tcp_port)
+    except OSError as error:
+        print(f"Cannot listen on {program_args.listen}: {error}")
+        return
+    print(f"serving on {program_args.listen} UDP port "
+          f"{dns_server.udp_address[1]}, TCP port "
+          f"{dns_server.tcp_address[1]}", flush=True)
+    try:
+        dns_server.serve_forever(program_args.report_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(dns_server.report(0))
+        dns_server.close()
+
+
+def bulk(program_args) -> None:
+    """
+    resolve the names of --input as JSON lines on stdout; everything else
+    the resolver prints goes to stderr so the output stays parseable
+    """
+    if program_args.input == "-":
+        names = sys.stdin
+    else:
+        try:
+            names = open(program_args.input, encoding="utf-8")
+        except OSError as error:
+            print(f"Cannot read {program_args.input}: {error}")
+            return
+    out = sys.stdout
+    with names, contextlib.redirect_stdout(sys.stderr):
+        total = resolve_stream(names, program_args.concurrency, out,
+                               program_args.report_interval)
+    if program_args.verbose:
+        print(f"{total} names", file=sys.stderr)
+
+
 def main():
     """
     if run from the command line, take args and call
     printresults(lookup(hostname))
     """
     argument_parser = argparse.ArgumentParser()
-    argument_parser.add_argument("name", nargs="+", help="DNS name(s) to look up")
+    argument_parser.add_argument("name", nargs="*", help="DNS name(s) to look up")
     argument_parser.add_argument(
         "-v", "--verbose", help="increase output verbosity", action="store_true"
     )
+    argument_parser.add_argument(
+        "--cache-bytes", type=int, default=cache.max_bytes,
+        help="memory budget of the record cache"
+    )
+    argument_parser.add_argument(
+        "--stale-window", type=float, default=cache.stale_window,
+        help="seconds past their TTL cached answers may be served when "
+             "resolving fails, 0 to never serve stale answers"
+    )
+    argument_parser.add_argument(
+        "--concurrency", type=int, default=MAX_WORKERS,
+        help="lookups in flight at the same time"
+    )
+    argument_parser.add_argument(
+        "--cache-file", help="load the caches from and save them to this file"
+    )
+    argument_parser.add_argument(
+        "--save-interval", type=float, default=0,
+        help="also save the cache file every this many seconds"
+    )
+    argument_parser.add_argument(
+        "--edns-payload", type=int, default=EDNS_PAYLOAD,
+        help="UDP payload size to advertise with EDNS0, 0 to not use EDNS"
+    )
+    argument_parser.add_argument(
+        "--root-hints",
+        help="comma separated root server addresses to use instead of the "
+             "real ones"
+    )
+    argument_parser.add_argument(
+        "--upstream-port", type=int, default=53,
+        help="port to ask nameservers on"
+    )
+    argument_parser.add_argument(
+        "--serve", action="store_true",
+        help="run as a DNS server instead of looking up names"
+    )
+    argument_parser.add_argument(
+        "--listen", default="127.0.0.1", help="address to serve on"
+    )
+    argument_parser.add_argument(
+        "--port", type=int, default=5353, help="UDP port to serve on"
+    )
+    argument_parser.add_argument(
+        "--tcp-port", type=int, help="TCP port to serve on, default --port"
+    )
+    argument_parser.add_argument(
+        "--report-interval", type=float, default=10,
+        help="seconds between statistics lines of --serve and --input, "
+             "0 for none"
+    )
+    argument_parser.add_argument(
+        "--input",
+        help="look up the names in this file, one per line (- for stdin), "
+             "printing a JSON line for each as it completes"
+    )
     program_args = argument_parser.parse_args()
+    global edns_payload
+    edns_payload = program_args.edns_payload
+    set_root_hints(program_args.root_hints.split(",")
+                   if program_args.root_hints else ROOT_SERVERS,
+                   program_args.upstream_port)
+    if (not program_args.name and not program_args.serve
+            and not program_args.input):
+        argument_parser.error("give names to look up, --input or --serve")
+    cache.max_bytes = program_args.cache_bytes
+    cache.stale_window = program_args.stale_window
+    set_concurrency(program_args.concurrency)
+    if program_args.cache_file:
+        loaded = load_snapshot(program_args.cache_file)
+        if program_args.verbose:
+            print(f"loaded {loaded} entries from {program_args.cache_file}")
+        if program_args.save_interval > 0:
+            snapshot.save_every(program_args.cache_file,
+                                program_args.save_interval, cache, delegations)
+
+    if program_args.serve:
+        serve(program_args)
+    if program_args.input:
+        bulk(program_args)
 
     # remove duplicates from the list
     domain_list = caching(program_args.name)
 
+    # start the lookups of the next names while printing the current one,
+    # results still come out in the order of the names
+    window = deque()
     for a_domain_name in domain_list:
-        print_results(collect_results(a_domain_name))
+        window.append((a_domain_name, start_lookups(a_domain_name)))
+        if len(window) >= program_args.concurrency:
+            print_results(collect_results(*window.popleft()))
+    while window:
+        print_results(collect_results(*window.popleft()))
+    if program_args.cache_file:
+        save_snapshot(program_args.cache_file)
+
+    if program_args.verbose:
+        print(f"cache: {len(cache)} entries, {cache.size} bytes, {cache.stats}")
+        print(f"upstream: {stats}, coalesced: {inflight.stats}, "
+              f"tcp connections: {tcp_connections.stats}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,114 @@
+"""
+offline benchmark of the resolver against simulator.py running in a
+separate process
+
+    python resolve_bench.py [--zones 10] [--hosts 100] [--concurrency 64]
+                            [--latency 0.002] [--loss 0.01] [--port 5300]
+
+Half of the simulator's benchmark names are looked up twice:
+
+    cold        with empty caches
+    warm        again, answered from the record cache
+
+and the other half once, as
+
+    warm zones  new names in zones whose delegations are cached
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import time
+import dns.name
+import dns.rdatatype
+import resolve
+from simulator import benchmark_names
+
+
+def percentile(samples, q):
+    """
+    nearest-rank percentile of a sorted list
+    """
+    return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+
+def timed_lookup(name: dns.name.Name):
+    """
+    resolve the A records of name, return (seconds taken, succeeded)
+    """
+    start = time.perf_counter()
+    response = resolve.lookup(name, dns.rdatatype.A)
+    return time.perf_counter() - start, response is not None
+
+
+def run(names):
+    """
+    resolve names on the engine's thread pool, return (seconds, sorted
+    latencies, failures, upstream queries)
+    """
+    upstream = resolve.stats["upstream_queries"]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # "Time out: ..."
+        futures = [resolve.executor.submit(timed_lookup, name)
+                   for name in names]
+        results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+    latencies = sorted(seconds for seconds, _ in results)
+    failures = sum(not succeeded for _, succeeded in results)
+    return (elapsed, latencies, failures,
+            resolve.stats["upstream_queries"] - upstream)
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--zones", type=int, default=10)
+    parser.add_argument("--hosts", type=int, default=100,
+                        help="names in each zone")
+    parser.add_argument("--concurrency", type=int,
+                        default=resolve.MAX_WORKERS)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds each simulated server waits")
+    parser.add_argument("--loss", type=float, default=0.0,
+                        help="share of UDP queries the servers drop")
+    parser.add_argument("--port", type=int, default=5300)
+    options = parser.parse_args(args)
+
+    simulator = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(__file__),
+                                      "simulator.py"),
+         "--port", str(options.port), "--zones", str(options.zones),
+         "--hosts", str(options.hosts), "--latency", str(options.latency),
+         "--loss", str(options.loss)],
+        stdout=subprocess.PIPE, text=True)
+    try:
+        roots = simulator.stdout.readline().strip()
+        if not roots.startswith("127."):
+            raise RuntimeError(f"simulator did not start: {roots}")
+        resolve.set_root_hints(roots.split(","), options.port)
+        resolve.set_concurrency(options.concurrency)
+
+        names = [dns.name.from_text(name)
+                 for name in benchmark_names(options.zones, options.hosts)]
+        phases = (("cold", names[::2]), ("warm", names[::2]),
+                  ("warm zones", names[1::2]))
+        print(f"{'phase':>10} {'names':>6} {'names/s':>9} {'p50 ms':>8} "
+              f"{'p90 ms':>8} {'p99 ms':>8} {'upstream/name':>14} "
+              f"{'failed':>7}")
+        for phase, phase_names in phases:
+            elapsed, latencies, failures, upstream = run(phase_names)
+            print(f"{phase:>10} {len(phase_names):>6} "
+                  f"{len(phase_names) / elapsed:>9.1f} "
+                  f"{percentile(latencies, 50) * 1000:>8.2f} "
+                  f"{percentile(latencies, 90) * 1000:>8.2f} "
+                  f"{percentile(latencies, 99) * 1000:>8.2f} "
+                  f"{upstream / len(phase_names):>14.2f} {failures:>7}")
+    finally:
+        simulator.terminate()
+        simulator.wait()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,537 @@
+"""
+rrcache.py: a TTL-honouring, size-bounded DNS record cache with negative
+caching (RFC 2308), and a cache of delegations (zone cuts)
+"""
+
+from collections import OrderedDict
+import struct
+import threading
+import time
+import dns.name
+import dns.rcode
+import dns.rdata
+import dns.rdataclass
+import dns.rdatatype
+import dns.rdtypes.IN.A
+import dns.rdtypes.IN.AAAA
+import dns.rrset
+
+# memory an entry takes besides its owner name and packed rdatas, measured
+# with cache_bench.py: key tuple, Entry, dictionary slot and LRU links
+ENTRY_OVERHEAD = 500
+
+NXDOMAIN = dns.rcode.NXDOMAIN
+NODATA = "NODATA"
+
+# RFC 8767: how long past its TTL an entry may still be served when the
+# resolution fails, and the TTL such a stale answer is given
+STALE_WINDOW = 24 * 60 * 60
+STALE_TTL = 30
+
+# an entry hit this often is refreshed once the last tenth of its TTL starts
+PREFETCH_HITS = 3
+PREFETCH_WINDOW = 0.1
+
+# rdatas of these types are packed as bare addresses
+ADDRESS_TYPES = {dns.rdatatype.A: (4, dns.rdtypes.IN.A.A),
+                 dns.rdatatype.AAAA: (16, dns.rdtypes.IN.AAAA.AAAA)}
+
+
+def pack_rrset(rrset: dns.rrset.RRset) -> bytes:
+    """
+    the rdatas of rrset in one bytes object: IN A and AAAA addresses back
+    to back, any other type as a length-prefixed run of uncompressed wire
+    data
+    """
+    if rrset.rdclass == dns.rdataclass.IN and rrset.rdtype in ADDRESS_TYPES:
+        return b"".join(rdata.to_wire() for rdata in rrset)
+    parts = []
+    for rdata in rrset:
+        wire = rdata.to_wire()
+        parts.append(struct.pack("!H", len(wire)))
+        parts.append(wire)
+    return b"".join(parts)
+
+
+def unpack_rrset(name, rdtype, rdclass, ttl, wire: bytes) -> dns.rrset.RRset:
+    """
+    rebuild the RRset pack_rrset() packed into wire
+    """
+    rrset = dns.rrset.RRset(name, rdclass, rdtype)
+    if rdclass == dns.rdataclass.IN and rdtype in ADDRESS_TYPES:
+        length, rdata_class = ADDRESS_TYPES[rdtype]
+        for pos in range(0, len(wire), length):
+            rrset.add(rdata_class(rdclass, rdtype, wire[pos:pos + length]),
+                      ttl)
+        return rrset
+    pos = 0
+    while pos < len(wire):
+        (length,) = struct.unpack_from("!H", wire, pos)
+        rrset.add(dns.rdata.from_wire(rdclass, rdtype, wire, pos + 2,
+                                      length), ttl)
+        pos += 2 + length
+    return rrset
+
+
+def negative_ttl(soa_rrset: dns.rrset.RRset) -> int:
+    """
+    RFC 2308 section 5: negative answers live for the smaller of the SOA
+    record's TTL and its MINIMUM field
+    """
+    return min(soa_rrset.ttl, soa_rrset[0].minimum)
+
+
+class Entry:
+    """
+    a cached value, packed rdatas (see pack_rrset), NXDOMAIN or NODATA,
+    with the time it expires, the TTL it was cached with, the time it may
+    be served stale until and the bytes it is counted for; and how often
+    it was used, and if a refresh was asked for. A negative answer keeps
+    the zone's SOA as (wire-format owner name, packed rdatas).
+    """
+
+    __slots__ = ("expires", "value", "size", "ttl", "stale_until", "hits",
+                 "refreshing", "soa")
+
+    def __init__(self, expires: float, value, size: int, ttl: float,
+                 stale_until: float, soa=None):
+        self.expires = expires
+        self.value = value
+        self.size = size
+        self.ttl = ttl
+        self.stale_until = stale_until
+        self.hits = 0
+        self.refreshing = False
+        self.soa = soa
+
+
+class RecordCache:
+    """
+    RRsets and negative answers keyed by (name, rdtype, rdclass). Entries
+    expire with their TTL and the least recently used ones are evicted
+    once the cache holds more than max_bytes.
+
+    RRsets are stored packed and rebuilt when asked for; owner names are
+    interned, so the types cached for one name share a single Name.
+
+    Expired entries are kept for stale_window more seconds, for get_answer
+    to fall back on (RFC 8767). An RRset hit prefetch_hits times is handed
+    to prefetch(name, rdtype, rdclass), if set, once it is in the last
+    PREFETCH_WINDOW of its TTL, so it can be refreshed before it expires.
+    """
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024,
+                 stale_window: float = STALE_WINDOW):
+        self.max_bytes = max_bytes
+        self.stale_window = stale_window
+        self.prefetch = None
+        self.prefetch_hits = PREFETCH_HITS
+        self.size = 0
+        self.stats = {"hits": 0, "misses": 0, "negative_hits": 0,
+                      "expired": 0, "evictions": 0, "stale_hits": 0,
+                      "prefetches": 0}
+        self._entries = OrderedDict()  # key -> Entry
+        self._names = {}  # owner name -> [the shared Name, entries using it]
+        # entries restored from a snapshot and not used since, keyed by
+        # (lowercase wire-format name, rdtype, rdclass); hashing bytes is
+        # much cheaper than hashing a dns.name.Name
+        self._cold = {}
+        self._due = []  # keys _value() found due for a prefetch
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries) + len(self._cold)
+
+    def _entry(self, ttl, value, size, now, soa=None):
+        return Entry(now + ttl, value, size, ttl,
+                     now + ttl + self.stale_window, soa)
+
+    def _get(self, key, now, stale=False):
+        """
+        return the live Entry under key or, if stale, an expired one still
+        within the stale window; drop it once past that
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires <= now:
+            if entry.stale_until <= now:
+                self._drop(key)
+                self.stats["expired"] += 1
+                return None
+            if not stale:
+                return None
+            # answer from it for STALE_TTL seconds before the resolver
+            # tries upstream again
+            entry.expires = min(now + STALE_TTL, entry.stale_until)
+            self.stats["stale_hits"] += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key, entry):
+        """
+        store entry, then evict least recently used entries over budget
+        """
+        self._drop(key)
+        name, rdtype, rdclass = key
+        interned = self._names.get(name)
+        if interned is None:
+            interned = self._names[name] = [name, 0]
+        interned[1] += 1
+        self._entries[(interned[0], rdtype, rdclass)] = entry
+        self.size += entry.size
+        self._trim()
+
+    def _trim(self):
+        """
+        evict entries until the cache is within budget, unused snapshot
+        entries first, then the least recently used
+        """
+        while self.size > self.max_bytes and (self._cold or self._entries):
+            if self._cold:
+                self.size -= self._cold.pop(next(iter(self._cold))).size
+            else:
+                self._drop(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def _warm(self, key, now, stale=False):
+        """
+        move the snapshot entry for key, if any, into the cache proper and
+        return it as _get() would
+        """
+        name, rdtype, rdclass = key
+        entry = self._cold.pop((name.to_wire().lower(), rdtype, rdclass),
+                               None)
+        if entry is None:
+            return None
+        self.size -= entry.size
+        if entry.stale_until <= now:
+            self.stats["expired"] += 1
+            return None
+        self._put(key, entry)
+        return self._get(key, now, stale)
+
+    def _drop(self, key):
+        """
+        remove key and give back its size
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= entry.size
+        interned = self._names[key[0]]
+        interned[1] -= 1
+        if not interned[1]:
+            del self._names[key[0]]
+
+    def _value(self, name, rdtype, rdclass, now, stale=False):
+        """
+        return the cached RRset (rebuilt with the TTL it has left),
+        NXDOMAIN, NODATA or None; the caller holds the lock. A popular
+        RRset near its expiry is queued for _prefetch().
+        """
+        key = (name, rdtype, rdclass)
+        entry = self._get(key, now, stale)
+        if entry is None and self._cold:
+            entry = self._warm(key, now, stale)
+        if entry is None:
+            return None
+        if not isinstance(entry.value, bytes):
+            return entry.value
+        entry.hits += 1
+        if (self.prefetch is not None and not entry.refreshing
+                and entry.hits >= self.prefetch_hits
+                and entry.expires - now <= entry.ttl * PREFETCH_WINDOW):
+            entry.refreshing = True
+            self.stats["prefetches"] += 1
+            self._due.append(key)
+        return unpack_rrset(name, rdtype, rdclass,
+                            max(int(entry.expires - now), 0), entry.value)
+
+    def _authority(self, key, now):
+        """
+        the authority section for the negative entry under key, which
+        _value() just returned: its SOA with the TTL the entry has left
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry.soa is None:
+            return []
+        name_wire, wire = entry.soa
+        return [unpack_rrset(dns.name.from_wire(name_wire, 0)[0],
+                             dns.rdatatype.SOA, key[2],
+                             max(int(entry.expires - now), 0), wire)]
+
+    def _prefetch(self):
+        """
+        hand the keys queued by _value() to prefetch, outside the lock
+        """
+        while self._due:
+            try:
+                name, rdtype, rdclass = self._due.pop()
+            except IndexError:  # taken by another thread
+                return
+            self.prefetch(name, rdtype, rdclass)
+
+    def _count(self, value):
+        """
+        count a hit, negative hit or miss for value
+        """
+        if value is None:
+            self.stats["misses"] += 1
+        elif isinstance(value, dns.rrset.RRset):
+            self.stats["hits"] += 1
+        else:
+            self.stats["negative_hits"] += 1
+
+    def get(self, name, rdtype, rdclass=dns.rdataclass.IN):
+        """
+        return the cached RRset, NXDOMAIN, NODATA or None
+        """
+        with self._lock:
+            value = self._value(name, rdtype, rdclass, time.monotonic())
+            self._count(value)
+        self._prefetch()
+        return value
+
+    def peek(self, name, rdtype, rdclass=dns.rdataclass.IN):
+        """
+        get() for the resolver's own bookkeeping, not counted in stats
+        """
+        with self._lock:
+            value = self._value(name, rdtype, rdclass, time.monotonic())
+        self._prefetch()
+        return value
+
+    def put(self, rrset: dns.rrset.RRset):
+        """
+        cache an RRset for its TTL
+        """
+        if rrset.ttl <= 0:
+            return
+        wire = pack_rrset(rrset)
+        entry = self._entry(rrset.ttl, wire,
+                            ENTRY_OVERHEAD + len(rrset.name.to_wire())
+                            + len(wire), time.monotonic())
+        with self._lock:
+            self._put((rrset.name, rrset.rdtype, rrset.rdclass), entry)
+
+    def put_negative(self, name, rdtype, kind, soa_rrset,
+                     rdclass=dns.rdataclass.IN):
+        """
+        cache that name does not exist (kind NXDOMAIN) or has no rdtype
+        records (kind NODATA), for the negative TTL of soa_rrset
+        """
+        ttl = negative_ttl(soa_rrset)
+        if ttl <= 0:
+            return
+        # an NXDOMAIN covers every type, cache it under ANY as well
+        key = (name, dns.rdatatype.ANY if kind == NXDOMAIN else rdtype,
+               rdclass)
+        soa = (soa_rrset.name.to_wire(), pack_rrset(soa_rrset))
+        entry = self._entry(ttl, kind,
+                            ENTRY_OVERHEAD + len(name.to_wire())
+                            + len(soa[0]) + len(soa[1]), time.monotonic(),
+                            soa)
+        with self._lock:
+            self._put(key, entry)
+
+    def items(self):
+        """
+        return (wire-format name, rdtype, rdclass, seconds left, value,
+        soa) for every live entry; value is packed rdatas (see
+        pack_rrset), NXDOMAIN or NODATA, and soa the SOA of a negative
+        answer as Entry keeps it, or None
+        """
+        now = time.monotonic()
+        with self._lock:
+            hot = [key + (entry,) for key, entry in self._entries.items()
+                   if entry.expires > now]
+            cold = [key + (entry.expires - now, entry.value, entry.soa)
+                    for key, entry in self._cold.items()
+                    if entry.expires > now]
+        # cold first, so a newer hot entry for the same key wins on restore
+        return cold + [(name.to_wire(), rdtype, rdclass, entry.expires - now,
+                        entry.value, entry.soa)
+                       for name, rdtype, rdclass, entry in hot]
+
+    def restore(self, entries):
+        """
+        put back entries as items() returned them, each to live the
+        seconds it has left. They are only looked at when first asked for.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for name_wire, rdtype, rdclass, ttl, value, soa in entries:
+                size = ENTRY_OVERHEAD + len(name_wire)
+                if isinstance(value, bytes):
+                    size += len(value)
+                if soa is not None:
+                    size += len(soa[0]) + len(soa[1])
+                key = (name_wire.lower(), rdtype, rdclass)
+                old = self._cold.pop(key, None)
+                if old is not None:
+                    self.size -= old.size
+                self._cold[key] = self._entry(ttl, value, size, now, soa)
+                self.size += size
+            self._trim()
+
+    def get_answer(self, name, rdtype, rdclass=dns.rdataclass.IN,
+                   stale: bool = False):
+        """
+        return (rcode, answer RRsets, authority RRsets) assembled from the
+        cache, following cached CNAMEs, or None if any part of the answer
+        is missing. The authority section holds the zone's SOA of a
+        negative answer (RFC 2308 section 3). With
+        stale, entries expired less than stale_window ago are used too,
+        each answered with a TTL of STALE_TTL.
+        """
+        now = time.monotonic()
+        answer = []
+        result = None
+        with self._lock:
+            for _ in range(16):  # bounds CNAME loops
+                if self._value(name, dns.rdatatype.ANY, rdclass, now,
+                               stale) == NXDOMAIN:
+                    result = (NXDOMAIN, answer, self._authority(
+                        (name, dns.rdatatype.ANY, rdclass), now))
+                    break
+                value = self._value(name, rdtype, rdclass, now, stale)
+                if value == NODATA:
+                    result = (dns.rcode.NOERROR, answer, self._authority(
+                        (name, rdtype, rdclass), now))
+                    break
+                if value is not None:
+                    result = (dns.rcode.NOERROR, answer + [value], [])
+                    break
+                if rdtype == dns.rdatatype.CNAME:
+                    break
+                cname = self._value(name, dns.rdatatype.CNAME, rdclass, now,
+                                    stale)
+                if not isinstance(cname, dns.rrset.RRset):
+                    break
+                answer.append(cname)
+                name = cname[0].target
+            if result is None:
+                self.stats["misses"] += 1
+            elif result[1] and result[1][-1].rdtype == rdtype:
+                self.stats["hits"] += 1
+            else:
+                self.stats["negative_hits"] += 1
+        self._prefetch()
+        return result
+
+
+class DelegationCache:
+    """
+    zone cuts learnt from referrals: the NS names of each zone and the glue
+    addresses that came with them, each kept for its TTL. At most
+    max_entries zones and nameservers are kept, least recently used first
+    out.
+    """
+
+    def __init__(self, max_entries: int = 100000):
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "misses": 0}
+        self._zones = OrderedDict()  # zone -> (expires, NS names)
+        self._glue = OrderedDict()  # NS name -> (expires, addresses)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._zones)
+
+    def _store(self, table, key, ttl, value):
+        """
+        store value under key for ttl seconds, then trim table
+        """
+        table.pop(key, None)
+        table[key] = (time.monotonic() + ttl, value)
+        while len(table) > self.max_entries:
+            table.popitem(last=False)
+
+    @staticmethod
+    def _live(table, key, now):
+        """
+        return the unexpired value under key, or None
+        """
+        entry = table.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del table[key]
+            return None
+        table.move_to_end(key)
+        return entry[1]
+
+    def put(self, ns_rrset: dns.rrset.RRset, glue: list):
+        """
+        remember a referral: its NS RRset and the A/AAAA glue RRsets for
+        those nameservers
+        """
+        with self._lock:
+            if ns_rrset.ttl > 0:
+                self._store(self._zones, ns_rrset.name, ns_rrset.ttl,
+                            tuple(rdata.target for rdata in ns_rrset))
+            for rrset in glue:
+                if rrset.ttl > 0 and rrset.rdtype == dns.rdatatype.A:
+                    self._store(self._glue, rrset.name, rrset.ttl,
+                                tuple(rdata.address for rdata in rrset))
+
+    def items(self):
+        """
+        return (NS, zone, seconds left, NS names) for every live zone cut
+        and (A, NS name, seconds left, addresses) for every live glue entry
+        """
+        now = time.monotonic()
+        with self._lock:
+            return ([(dns.rdatatype.NS, zone, expires - now, ns_names)
+                     for zone, (expires, ns_names) in self._zones.items()
+                     if expires > now]
+                    + [(dns.rdatatype.A, ns_name, expires - now, addresses)
+                       for ns_name, (expires, addresses)
+                       in self._glue.items() if expires > now])
+
+    def restore(self, rdtype, name, ttl, value):
+        """
+        put back an entry items() returned, to live ttl more seconds
+        """
+        table = self._zones if rdtype == dns.rdatatype.NS else self._glue
+        with self._lock:
+            self._store(table, name, ttl, tuple(value))
+
+    def nameservers(self, zone):
+        """
+        return the NS names cached for zone, or None
+        """
+        with self._lock:
+            return self._live(self._zones, zone, time.monotonic())
+
+    def glue(self, ns_name):
+        """
+        return the glue addresses cached for ns_name, or None
+        """
+        with self._lock:
+            return self._live(self._glue, ns_name, time.monotonic())
+
+    def closest(self, name, records: RecordCache):
+        """
+        return (zone, addresses) for the deepest cached zone cut above name
+        whose nameservers have a known address, from glue or from A records
+        in records; or None if only the root is known
+        """
+        while name != dns.name.root:
+            ns_names = self.nameservers(name)
+            if ns_names:
+                addresses = []
+                for ns_name in ns_names:
+                    glue = self.glue(ns_name)
+                    if glue is None:
+                        rrset = records.peek(ns_name, dns.rdatatype.A)
+                        if isinstance(rrset, dns.rrset.RRset):
+                            glue = [rdata.address for rdata in rrset]
+                    addresses.extend(glue or ())
+                if addresses:
+                    self.stats["hits"] += 1
+                    return name, addresses
+            name = name.parent()
+        self.stats["misses"] += 1
+        return None
@@ -0,0 +1,355 @@
+"""
+server.py: a caching recursive DNS server on UDP and TCP.
+
+One thread runs a selectors loop over every socket. Queries the cache can
+answer are answered right there; the others go to the resolver's thread
+pool, and their results come back to the loop through a socketpair, so
+no thread or process is started per query or per client.
+"""
+
+from collections import deque
+import selectors
+import socket
+import struct
+import time
+import dns.exception
+import dns.flags
+import dns.message
+import dns.opcode
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+
+REPORT_INTERVAL = 10  # seconds between two statistics lines
+TCP_IDLE_TIMEOUT = 10  # seconds a TCP client may stay quiet
+MAX_PENDING = 1000  # recursions in flight before new ones get SERVFAIL
+MAX_TCP_OUTPUT = 1024 * 1024  # unsent bytes before a TCP client is dropped
+
+
+class TCPClient:
+    """
+    a TCP connection: bytes read but not parsed yet, bytes not sent yet
+    and the queries it is still waiting for
+    """
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.input = bytearray()
+        self.output = bytearray()
+        self.pending = 0
+        self.last_active = time.monotonic()
+        self.closed = False
+
+
+def make_answer(query: dns.message.Message,
+                found: dns.message.Message) -> dns.message.Message:
+    """
+    the response to query carrying the answer of found, a response from
+    the cache or from the recursion, or SERVFAIL if found is None
+    """
+    response = dns.message.make_response(query)
+    response.flags |= dns.flags.RA
+    if found is None:
+        response.set_rcode(dns.rcode.SERVFAIL)
+        return response
+    response.set_rcode(found.rcode())
+    response.answer = list(found.answer)
+    rdtype = query.question[0].rdtype
+    if (found.rcode() == dns.rcode.NXDOMAIN
+            or not any(rrset.rdtype == rdtype for rrset in found.answer)):
+        # a negative answer, maybe at the end of a CNAME chain: the SOA
+        # tells clients how long to cache it (RFC 2308)
+        response.authority = [rrset for rrset in found.authority
+                              if rrset.rdtype == dns.rdatatype.SOA]
+    return response
+
+
+class DNSServer:
+    """
+    answers queries on UDP and TCP port of address. cached(name, rdtype)
+    returns a response from the cache or None; resolve(name, rdtype)
+    returns a concurrent.futures.Future of a response, None if the
+    resolution failed.
+    """
+
+    def __init__(self, cached, resolve, address: str = "127.0.0.1",
+                 port: int = 53, tcp_port: int = None):
+        self.cached = cached
+        self.resolve = resolve
+        self.stats = {"queries": 0, "cache_hits": 0, "recursions": 0,
+                      "servfail": 0, "malformed": 0, "tcp_clients": 0,
+                      "errors": 0}
+        self.pending = 0
+        self._done = deque()  # (client, query, response) from the pool
+        self._clients = set()
+        self._selector = selectors.DefaultSelector()
+
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.bind((address, port))
+        self.udp.setblocking(False)
+        self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp.bind((address, self.udp.getsockname()[1]
+                       if tcp_port is None else tcp_port))
+        self.tcp.listen(128)
+        self.tcp.setblocking(False)
+        self._wake_read, self._wake_write = socket.socketpair()
+        self._wake_read.setblocking(False)
+        self._wake_write.setblocking(False)
+
+        self._selector.register(self.udp, selectors.EVENT_READ,
+                                self._read_udp)
+        self._selector.register(self.tcp, selectors.EVENT_READ, self._accept)
+        self._selector.register(self._wake_read, selectors.EVENT_READ,
+                                self._finish)
+
+    @property
+    def udp_address(self):
+        return self.udp.getsockname()
+
+    @property
+    def tcp_address(self):
+        return self.tcp.getsockname()
+
+    def serve_forever(self, report_interval: float = REPORT_INTERVAL):
+        """
+        answer queries until interrupted, printing queries/sec and the
+        cache hit rate every report_interval seconds (never if 0)
+        """
+        last_report = last_idle_check = time.monotonic()
+        last_queries = 0
+        while True:
+            for key, mask in self._selector.select(timeout=1.0):
+                key.data(key.fileobj, mask)
+            now = time.monotonic()
+            if now - last_idle_check >= 1.0:
+                self._close_idle(now)
+                last_idle_check = now
+            if report_interval and now - last_report >= report_interval:
+                queries = self.stats["queries"]
+                print(self.report((queries - last_queries)
+                                  / (now - last_report)), flush=True)
+                last_report, last_queries = now, queries
+
+    def report(self, qps: float) -> str:
+        """
+        one line of statistics
+        """
+        answered = self.stats["cache_hits"] + self.stats["recursions"]
+        hit_rate = self.stats["cache_hits"] / answered if answered else 0
+        return (f"{qps:.0f} queries/sec, {hit_rate:.0%} cache hits, "
+                f"{self.pending} in flight, {self.stats}")
+
+    def close(self):
+        for client in list(self._clients):
+            self._close(client)
+        for sock in (self.udp, self.tcp, self._wake_read, self._wake_write):
+            sock.close()
+        self._selector.close()
+
+    def _read_udp(self, sock, _mask):
+        """
+        read the datagrams waiting on the UDP socket
+        """
+        for _ in range(64):  # let TCP clients have their turn too
+            try:
+                wire, address = sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:  # ICMP errors of earlier replies
+                continue
+            self._query(wire, address)
+
+    def _accept(self, sock, _mask):
+        try:
+            conn, _ = sock.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as error:
+            print(f"Cannot accept TCP client: {error}")
+            return
+        conn.setblocking(False)
+        client = TCPClient(conn)
+        self._clients.add(client)
+        self.stats["tcp_clients"] += 1
+        self._selector.register(conn, selectors.EVENT_READ,
+                                lambda _sock, mask: self._tcp_event(client,
+                                                                    mask))
+
+    def _tcp_event(self, client: TCPClient, mask):
+        """
+        read length-prefixed queries from client, or send it more output
+        """
+        client.last_active = time.monotonic()
+        if mask & selectors.EVENT_WRITE:
+            self._flush(client)
+        if not mask & selectors.EVENT_READ or client.closed:
+            return
+        try:
+            data = client.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close(client)
+            return
+        client.input += data
+        while len(client.input) >= 2:
+            (length,) = struct.unpack_from("!H", client.input)
+            if len(client.input) < 2 + length:
+                break
+            wire = bytes(client.input[2:2 + length])
+            del client.input[:2 + length]
+            self._query(wire, client)
+
+    def _query(self, wire: bytes, client):
+        """
+        answer the query in wire from client, a TCPClient or the address
+        of a UDP client
+        """
+        try:
+            query = dns.message.from_wire(wire)
+        except dns.exception.DNSException:
+            self.stats["malformed"] += 1
+            return
+        if query.flags & dns.flags.QR:  # a response, never answer those
+            self.stats["malformed"] += 1
+            return
+        self.stats["queries"] += 1
+        try:
+            self._answer(query, client)
+        except Exception as error:  # pylint: disable=broad-except
+            # one bad query must not stop the server
+            self.stats["errors"] += 1
+            print(f"Error answering query: {error!r}")
+
+    def _answer(self, query: dns.message.Message, client):
+        """
+        reply to query from the cache, or start its recursion
+        """
+        response = None
+        if query.opcode() != dns.opcode.QUERY:
+            response = dns.message.make_response(query)
+            response.set_rcode(dns.rcode.NOTIMP)
+        elif (len(query.question) != 1
+              or query.question[0].rdclass != dns.rdataclass.IN):
+            response = dns.message.make_response(query)
+            response.set_rcode(dns.rcode.REFUSED if query.question
+                               else dns.rcode.FORMERR)
+        else:
+            question = query.question[0]
+            found = self.cached(question.name, question.rdtype)
+            if found is not None:
+                self.stats["cache_hits"] += 1
+                response = make_answer(query, found)
+            elif self.pending >= MAX_PENDING:
+                self.stats["servfail"] += 1
+                response = make_answer(query, None)
+        if response is not None:
+            self._reply(client, query, response)
+            return
+
+        self.stats["recursions"] += 1
+        self.pending += 1
+        if isinstance(client, TCPClient):
+            client.pending += 1
+        future = self.resolve(question.name, question.rdtype)
+        future.add_done_callback(
+            lambda done: self._resolved(client, query, done))
+
+    def _resolved(self, client, query, future):
+        """
+        runs in a pool thread: hand the result to the loop and wake it
+        """
+        try:
+            found = future.result()
+        except Exception:  # pylint: disable=broad-except
+            found = None
+        self._done.append((client, query, found))
+        try:
+            self._wake_write.send(b"\0")
+        except (BlockingIOError, OSError):  # already awake, or closed
+            pass
+
+    def _finish(self, sock, _mask):
+        """
+        reply to the queries the pool finished
+        """
+        try:
+            while sock.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        while self._done:
+            client, query, found = self._done.popleft()
+            self.pending -= 1
+            if isinstance(client, TCPClient):
+                client.pending -= 1
+            if found is None:
+                self.stats["servfail"] += 1
+            try:
+                self._reply(client, query, make_answer(query, found))
+            except Exception as error:  # pylint: disable=broad-except
+                self.stats["errors"] += 1
+                print(f"Error answering query: {error!r}")
+
+    def _reply(self, client, query, response):
+        """
+        send response to client: length-prefixed over TCP, over UDP cut
+        down to the client's payload size with the TC bit set if too big
+        """
+        if isinstance(client, TCPClient):
+            if client.closed:
+                return
+            wire = response.to_wire()
+            client.output += struct.pack("!H", len(wire)) + wire
+            self._flush(client)
+            return
+        limit = max(512, query.payload) if query.edns >= 0 else 512
+        wire = response.to_wire(max_size=limit, prefer_truncation=True)
+        try:
+            self.udp.sendto(wire, client)
+        except OSError:  # the client will ask again
+            pass
+
+    def _flush(self, client: TCPClient):
+        """
+        send what client can take now, wait for it to be writable for the
+        rest
+        """
+        try:
+            sent = client.sock.send(client.output)
+            del client.output[:sent]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self._close(client)
+            return
+        if len(client.output) > MAX_TCP_OUTPUT:
+            self._close(client)
+            return
+        events = selectors.EVENT_READ
+        if client.output:
+            events |= selectors.EVENT_WRITE
+        key = self._selector.get_key(client.sock)
+        if key.events != events:
+            self._selector.modify(client.sock, events, key.data)
+
+    def _close(self, client: TCPClient):
+        if client.closed:
+            return
+        client.closed = True
+        self._clients.discard(client)
+        self._selector.unregister(client.sock)
+        client.sock.close()
+
+    def _close_idle(self, now: float):
+        """
+        close TCP clients that sent nothing for TCP_IDLE_TIMEOUT and are
+        owed no answer
+        """
+        for client in list(self._clients):
+            if (not client.pending and not client.output
+                    and now - client.last_active > TCP_IDLE_TIMEOUT):
+                self._close(client)
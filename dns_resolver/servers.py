@@ -0,0 +1,222 @@
+"""
+servers.py: smoothed-RTT nameserver selection with backoff, in the spirit
+of BIND and Unbound, and TCP connections to nameservers kept for reuse
+"""
+
+from collections import OrderedDict
+import random
+import socket
+import threading
+import time
+import dns.exception
+import dns.message
+import dns.query
+
+INITIAL_TIMEOUT = 1.0  # seconds, for a server we have no RTT for (RFC 6298)
+MIN_TIMEOUT = 0.1
+MAX_TIMEOUT = 3.0
+BACKOFF_BASE = 1.0  # seconds a server sits out after its first failure
+BACKOFF_MAX = 300.0
+EXPLORE = 0.05  # share of queries sent to a random server, not the fastest
+TCP_IDLE_TIMEOUT = 10  # seconds an unused connection is kept; servers
+# commonly close theirs after a few seconds more
+MAX_IDLE_PER_SERVER = 2
+
+
+class ServerStats:
+    """
+    per-server smoothed RTT and RTT variance, updated as in RFC 6298, with
+    exponential backoff for servers that time out, and whether they take
+    EDNS. At most max_servers servers are tracked, least recently used
+    first out.
+    """
+
+    def __init__(self, explore: float = EXPLORE, max_servers: int = 100000):
+        self.explore = explore
+        self.max_servers = max_servers
+        # address -> [srtt, rttvar, failures, blocked_until, edns]
+        self._servers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, server: str) -> list:
+        """
+        return the entry of server, creating it for an unknown server. An
+        unknown server gets a small random SRTT (as BIND does) so that it
+        is tried before known slow ones but after known fast ones.
+        """
+        entry = self._servers.get(server)
+        if entry is None:
+            entry = [random.uniform(0, 0.032), None, 0, 0.0, True]
+            self._servers[server] = entry
+            while len(self._servers) > self.max_servers:
+                self._servers.popitem(last=False)
+        else:
+            self._servers.move_to_end(server)
+        return entry
+
+    def srtt(self, server: str) -> float:
+        """
+        smoothed RTT of server in seconds
+        """
+        with self._lock:
+            return self._entry(server)[0]
+
+    def timeout(self, server: str) -> float:
+        """
+        how long to wait for server: SRTT + 4 * RTTVAR, clamped
+        """
+        with self._lock:
+            srtt, rttvar = self._entry(server)[:2]
+        if rttvar is None:
+            return INITIAL_TIMEOUT
+        return min(max(srtt + 4 * rttvar, MIN_TIMEOUT), MAX_TIMEOUT)
+
+    def select(self, servers, exclude=()) -> str:
+        """
+        return the server to ask next among servers, skipping exclude, or
+        None if none is left. Usually the lowest SRTT among servers not
+        backing off; now and then a random one, so recovered or faster
+        servers get noticed.
+        """
+        candidates = [server for server in servers if server not in exclude]
+        if not candidates:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entries = {server: self._entry(server) for server in candidates}
+        live = [server for server in candidates if entries[server][3] <= now]
+        if not live:  # all backing off, take the one that recovers first
+            return min(candidates, key=lambda server: entries[server][3])
+        if random.random() < self.explore:
+            return random.choice(live)
+        return min(live, key=lambda server: entries[server][0])
+
+    def success(self, server: str, rtt: float) -> None:
+        """
+        server answered after rtt seconds
+        """
+        with self._lock:
+            entry = self._entry(server)
+            if entry[1] is None:
+                entry[0], entry[1] = rtt, rtt / 2
+            else:
+                entry[1] = 0.75 * entry[1] + 0.25 * abs(entry[0] - rtt)
+                entry[0] = 0.875 * entry[0] + 0.125 * rtt
+            entry[2] = 0
+            entry[3] = 0.0
+
+    def failure(self, server: str) -> None:
+        """
+        server timed out or sent an unusable answer: double its SRTT and
+        block it for an exponentially growing time
+        """
+        with self._lock:
+            entry = self._entry(server)
+            entry[0] = min(max(entry[0], MIN_TIMEOUT) * 2, MAX_TIMEOUT)
+            entry[2] += 1
+            entry[3] = time.monotonic() + min(
+                BACKOFF_BASE * 2 ** (entry[2] - 1), BACKOFF_MAX)
+
+
+    def edns(self, server: str) -> bool:
+        """
+        whether queries to server may carry EDNS
+        """
+        with self._lock:
+            return self._entry(server)[4]
+
+    def no_edns(self, server: str) -> None:
+        """
+        server rejected EDNS: send it plain queries from now on
+        """
+        with self._lock:
+            self._entry(server)[4] = False
+
+
+class TCPConnections:
+    """
+    idle TCP connections to nameservers, at most max_idle per server, so
+    that queries to the same server reuse one connection instead of
+    opening a new one each time
+    """
+
+    def __init__(self, max_idle: int = MAX_IDLE_PER_SERVER,
+                 idle_timeout: float = TCP_IDLE_TIMEOUT):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.stats = {"opened": 0, "reused": 0}
+        self._idle = {}  # address -> [(socket, idle since)]
+        self._lock = threading.Lock()
+
+    def _acquire(self, server):
+        """
+        return an idle connection to server, an (address, port) pair, that
+        is not too old, or None
+        """
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(server, [])
+            while idle:
+                sock, since = idle.pop()
+                if now - since < self.idle_timeout:
+                    self.stats["reused"] += 1
+                    return sock
+                sock.close()
+        return None
+
+    def _release(self, server, sock: socket.socket):
+        with self._lock:
+            idle = self._idle.setdefault(server, [])
+            if len(idle) < self.max_idle:
+                idle.append((sock, time.monotonic()))
+                return
+        sock.close()
+
+    def _connect(self, server, timeout: float) -> socket.socket:
+        sock = socket.create_connection(server, timeout)
+        sock.setblocking(False)  # dns.query.tcp wants it so
+        with self._lock:
+            self.stats["opened"] += 1
+        return sock
+
+    def query(self, query: dns.message.Message, address: str,
+              timeout: float, port: int = 53) -> dns.message.Message:
+        """
+        send query to the server at address over TCP and return the
+        response, on a pooled connection if there is one. A pooled
+        connection the server has closed in the meantime is replaced by a
+        new one.
+        """
+        deadline = time.monotonic() + timeout
+        server = (address, port)
+        sock = self._acquire(server)
+        if sock is not None:
+            try:
+                response = dns.query.tcp(query, address, timeout, sock=sock)
+            except (EOFError, OSError, dns.exception.DNSException):
+                sock.close()
+            else:
+                self._release(server, sock)
+                return response
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise dns.exception.Timeout
+        try:
+            sock = self._connect(server, remaining)
+        except socket.timeout as error:
+            raise dns.exception.Timeout from error
+        try:
+            response = dns.query.tcp(query, address,
+                                     deadline - time.monotonic(), sock=sock)
+        except BaseException:
+            sock.close()
+            raise
+        self._release(server, sock)
+        return response
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for sock, _ in idle:
+                    sock.close()
+            self._idle.clear()
@@ -0,0 +1,415 @@
+"""
+simulator.py: a DNS hierarchy on loopback for offline tests and benchmarks
+of resolve.py.
+
+Root, TLD and authoritative servers each get a loopback address and all
+listen on the same port, UDP and TCP, so glue addresses work as on the
+internet. Servers can be given latency and packet loss.
+
+    python simulator.py [--port 5300] [--latency 0.002] [--loss 0.01]
+
+prints the root server addresses on its first line, then serves until
+interrupted; point the resolver at it with
+
+    python resolve.py --root-hints 127.0.1.1,127.0.1.2 --upstream-port 5300 \\
+        www.example.com
+
+The default hierarchy has:
+
+    example.com     A, MX, AAAA (v6.), a CNAME (www.), a CNAME chain
+                    (chain.), a CNAME into another zone (cdn.) and a TXT
+                    set too big for UDP (big.)
+    hoster.org      the nameserver of unglued.com
+    unglued.com     delegated to ns.hoster.org without glue
+    old.com         served by a server that does not know EDNS
+    zone<i>.com     host<k>.zone<i>.com A records, for benchmarks
+"""
+
+import argparse
+import heapq
+import random
+import socket
+import struct
+import threading
+import time
+import dns.exception
+import dns.flags
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+import dns.zone
+
+ROOTS = ("127.0.1.1", "127.0.1.2")
+
+
+class Server:
+    """
+    one nameserver: answers for its zones (dns.zone.Zone objects) on
+    address, replying latency seconds (plus up to jitter more) after a
+    query and dropping a share loss of UDP queries. A server without edns
+    answers FORMERR to queries that use it.
+    """
+
+    def __init__(self, address: str, zones, latency: float = 0.0,
+                 jitter: float = 0.0, loss: float = 0.0, edns: bool = True):
+        self.address = address
+        self.zones = {zone.origin: zone for zone in zones}
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.edns = edns
+        self.queries = 0
+        self._sockets = []
+        self._delayed = []  # heap of (send at, sequence, data, address)
+        self._sequence = 0
+        self._delayed_ready = threading.Condition()
+        # every name of each zone and their ancestors, to tell NXDOMAIN
+        # from NODATA
+        self._names = {}
+        for zone in zones:
+            names = set()
+            for name in zone.nodes:
+                while name not in names:
+                    names.add(name)
+                    if name == zone.origin:
+                        break
+                    name = name.parent()
+            self._names[zone.origin] = names
+
+    def answer(self, query: dns.message.Message) -> dns.message.Message:
+        response = dns.message.make_response(query)
+        if not self.edns and query.edns >= 0:
+            response.use_edns(False)
+            response.set_rcode(dns.rcode.FORMERR)
+            return response
+        if len(query.question) != 1:
+            response.set_rcode(dns.rcode.FORMERR)
+            return response
+        qname = query.question[0].name
+        qtype = query.question[0].rdtype
+        origins = [origin for origin in self.zones
+                   if qname.is_subdomain(origin)]
+        if not origins:
+            response.set_rcode(dns.rcode.REFUSED)
+            return response
+        zone = self.zones[max(origins, key=len)]
+
+        # a referral at the zone cut closest to the origin
+        for depth in range(len(zone.origin) + 1, len(qname) + 1):
+            cut = qname.split(depth)[1]
+            ns = zone.get_rdataset(cut, dns.rdatatype.NS)
+            if ns is not None:
+                response.authority.append(self._rrset(cut, ns))
+                for rdata in ns:
+                    for rdtype in (dns.rdatatype.A, dns.rdatatype.AAAA):
+                        glue = zone.get_rdataset(rdata.target, rdtype)
+                        if glue is not None:
+                            response.additional.append(
+                                self._rrset(rdata.target, glue))
+                return response
+
+        response.flags |= dns.flags.AA
+        name = qname
+        for _ in range(8):  # bounds CNAME loops
+            rdataset = zone.get_rdataset(name, qtype)
+            if rdataset is not None:
+                response.answer.append(self._rrset(name, rdataset))
+                return response
+            cname = zone.get_rdataset(name, dns.rdatatype.CNAME)
+            if cname is None:
+                break
+            response.answer.append(self._rrset(name, cname))
+            name = cname[0].target
+            if not name.is_subdomain(zone.origin):
+                return response
+        if name not in self._names[zone.origin]:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+        response.authority.append(self._rrset(
+            zone.origin, zone.get_rdataset(zone.origin, dns.rdatatype.SOA)))
+        return response
+
+    @staticmethod
+    def _rrset(name, rdataset) -> dns.rrset.RRset:
+        rrset = dns.rrset.RRset(name, rdataset.rdclass, rdataset.rdtype)
+        rrset.update(rdataset)
+        return rrset
+
+    def start(self, port: int):
+        """
+        serve UDP and TCP on port from daemon threads
+        """
+        udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp.bind((self.address, port))
+        tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        tcp.bind((self.address, port))
+        tcp.listen(64)
+        self._sockets = [udp, tcp]
+        for target, args in ((self._serve_udp, (udp,)),
+                             (self._serve_tcp, (tcp,)),
+                             (self._send_delayed, (udp,))):
+            threading.Thread(target=target, args=args, daemon=True).start()
+
+    def stop(self):
+        for sock in self._sockets:
+            sock.close()
+
+    def _delay(self) -> float:
+        return self.latency + random.uniform(0, self.jitter)
+
+    def _serve_udp(self, sock: socket.socket):
+        while True:
+            try:
+                wire, client = sock.recvfrom(65535)
+            except OSError:
+                return
+            self.queries += 1
+            if random.random() < self.loss:
+                continue
+            try:
+                query = dns.message.from_wire(wire)
+            except dns.exception.DNSException:
+                continue
+            limit = max(512, query.payload) if query.edns >= 0 else 512
+            reply = self.answer(query).to_wire(max_size=limit,
+                                               prefer_truncation=True)
+            delay = self._delay()
+            if not delay:
+                sock.sendto(reply, client)
+                continue
+            with self._delayed_ready:
+                self._sequence += 1
+                heapq.heappush(self._delayed, (time.monotonic() + delay,
+                                               self._sequence, reply, client))
+                self._delayed_ready.notify()
+
+    def _send_delayed(self, sock: socket.socket):
+        """
+        send the UDP replies held back for latency when they are due
+        """
+        while True:
+            with self._delayed_ready:
+                while not self._delayed:
+                    self._delayed_ready.wait()
+                due = self._delayed[0][0] - time.monotonic()
+                if due > 0:
+                    self._delayed_ready.wait(due)
+                    continue
+                _, _, reply, client = heapq.heappop(self._delayed)
+            try:
+                sock.sendto(reply, client)
+            except OSError:
+                return
+
+    def _serve_tcp(self, sock: socket.socket):
+        while True:
+            try:
+                conn, _ = sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._tcp_client, args=(conn,),
+                             daemon=True).start()
+
+    def _tcp_client(self, conn: socket.socket):
+        """
+        answer length-prefixed queries until the client hangs up
+        """
+        buffer = b""
+        with conn:
+            while True:
+                try:
+                    data = conn.recv(65536)
+                except OSError:
+                    return
+                if not data:
+                    return
+                buffer += data
+                while (len(buffer) >= 2 and len(buffer)
+                       >= 2 + struct.unpack("!H", buffer[:2])[0]):
+                    length = struct.unpack("!H", buffer[:2])[0]
+                    wire, buffer = buffer[2:2 + length], buffer[2 + length:]
+                    self.queries += 1
+                    try:
+                        query = dns.message.from_wire(wire)
+                    except dns.exception.DNSException:
+                        return
+                    reply = self.answer(query).to_wire(max_size=65535)
+                    time.sleep(self._delay())
+                    try:
+                        conn.sendall(struct.pack("!H", len(reply)) + reply)
+                    except OSError:
+                        return
+
+
+class Hierarchy:
+    """
+    a set of Servers started and stopped together; roots are the
+    addresses of the root servers
+    """
+
+    def __init__(self, servers, roots=ROOTS):
+        self.servers = servers
+        self.roots = tuple(roots)
+
+    @property
+    def queries(self) -> int:
+        return sum(server.queries for server in self.servers)
+
+    def start(self, port: int = 53):
+        for server in self.servers:
+            server.start(port)
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.stop()
+
+
+def make_zone(origin: str, text: str) -> dns.zone.Zone:
+    """
+    a zone from zone-file text, names absolute
+    """
+    return dns.zone.from_text(text, origin=origin, relativize=False)
+
+
+def benchmark_names(zones: int, hosts: int) -> list:
+    """
+    the host names default_hierarchy(zones, hosts) has A records for
+    """
+    return [f"host{k}.zone{i}.com" for i in range(zones)
+            for k in range(hosts)]
+
+
+def zone_address(i: int) -> str:
+    return f"127.0.{4 + i // 250}.{1 + i % 250}"
+
+
+def default_hierarchy(zones: int = 10, hosts: int = 100,
+                      latency: float = 0.0, jitter: float = 0.0,
+                      loss: float = 0.0) -> Hierarchy:
+    """
+    the hierarchy described in the module docstring, with zones zone<i>.com
+    of hosts names each; every server gets the same latency, jitter and
+    loss
+    """
+    soa = "@ 3600 SOA ns.sim. hostmaster.sim. 1 3600 600 86400 300\n"
+    root = soa + """
+@ 518400 NS a.root-servers.sim.
+@ 518400 NS b.root-servers.sim.
+a.root-servers.sim. 518400 A 127.0.1.1
+b.root-servers.sim. 518400 A 127.0.1.2
+com. 172800 NS a.gtld.sim.
+com. 172800 NS b.gtld.sim.
+a.gtld.sim. 172800 A 127.0.2.1
+b.gtld.sim. 172800 A 127.0.2.2
+org. 172800 NS a.org.sim.
+a.org.sim. 172800 A 127.0.2.3
+"""
+    com = soa + """
+@ 172800 NS a.gtld.sim.
+@ 172800 NS b.gtld.sim.
+example.com. 172800 NS ns1.example.com.
+ns1.example.com. 172800 A 127.0.3.1
+unglued.com. 172800 NS ns.hoster.org.
+old.com. 172800 NS ns1.old.com.
+ns1.old.com. 172800 A 127.0.3.4
+"""
+    com += "".join(f"zone{i}.com. 172800 NS ns1.zone{i}.com.\n"
+                   f"ns1.zone{i}.com. 172800 A {zone_address(i)}\n"
+                   for i in range(zones))
+    org = soa + """
+@ 172800 NS a.org.sim.
+hoster.org. 172800 NS ns1.hoster.org.
+ns1.hoster.org. 172800 A 127.0.3.2
+"""
+    example = soa + """
+@ 3600 NS ns1.example.com.
+ns1 3600 A 127.0.3.1
+@ 3600 A 93.184.216.34
+@ 3600 MX 10 mail.example.com.
+mail 300 A 93.184.216.35
+v6 300 AAAA 2001:db8::1
+www 300 CNAME example.com.
+chain 300 CNAME chain1.example.com.
+chain1 300 CNAME chain2.example.com.
+chain2 300 A 93.184.216.36
+cdn 300 CNAME edge.hoster.org.
+"""
+    example += "".join(f'big 300 TXT "{i:03d}{"x" * 120}"\n'
+                       for i in range(30))
+    hoster = soa + """
+@ 3600 NS ns1.hoster.org.
+ns1 3600 A 127.0.3.2
+ns 3600 A 127.0.3.3
+edge 300 A 192.0.2.80
+"""
+    unglued = soa + """
+@ 3600 NS ns.hoster.org.
+@ 3600 A 10.0.0.1
+www 3600 A 10.0.0.2
+"""
+    old = soa + """
+@ 3600 NS ns1.old.com.
+ns1 3600 A 127.0.3.4
+@ 3600 A 10.0.0.9
+"""
+    options = {"latency": latency, "jitter": jitter, "loss": loss}
+    root_zone = make_zone(".", root)
+    com_zone = make_zone("com.", com)
+    servers = [
+        Server("127.0.1.1", [root_zone], **options),
+        Server("127.0.1.2", [root_zone], **options),
+        Server("127.0.2.1", [com_zone], **options),
+        Server("127.0.2.2", [com_zone], **options),
+        Server("127.0.2.3", [make_zone("org.", org)], **options),
+        Server("127.0.3.1", [make_zone("example.com.", example)], **options),
+        Server("127.0.3.2", [make_zone("hoster.org.", hoster)], **options),
+        Server("127.0.3.3", [make_zone("unglued.com.", unglued)], **options),
+        Server("127.0.3.4", [make_zone("old.com.", old)], edns=False,
+               **options),
+    ]
+    for i in range(zones):
+        text = soa + (f"@ 3600 NS ns1.zone{i}.com.\n"
+                      f"ns1 3600 A {zone_address(i)}\n"
+                      f"www 300 CNAME host0.zone{i}.com.\n")
+        text += "".join(f"host{k} 300 A 10.{i % 256}.{k // 256 % 256}."
+                        f"{k % 256}\n" for k in range(hosts))
+        servers.append(Server(zone_address(i),
+                              [make_zone(f"zone{i}.com.", text)], **options))
+    return Hierarchy(servers)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=53,
+                        help="port every server listens on")
+    parser.add_argument("--zones", type=int, default=10,
+                        help="number of zone<i>.com benchmark zones")
+    parser.add_argument("--hosts", type=int, default=100,
+                        help="host names in each benchmark zone")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds each server waits before replying")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="up to this many more seconds of latency")
+    parser.add_argument("--loss", type=float, default=0.0,
+                        help="share of UDP queries each server drops")
+    options = parser.parse_args()
+    hierarchy = default_hierarchy(options.zones, options.hosts,
+                                  options.latency, options.jitter,
+                                  options.loss)
+    try:
+        hierarchy.start(options.port)
+    except OSError as error:
+        print(f"Cannot listen on port {options.port}: {error}")
+        return
+    print(",".join(hierarchy.roots), flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
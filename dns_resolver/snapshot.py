@@ -0,0 +1,165 @@
+"""
+snapshot.py: save the resolver's record and delegation caches to a file
+and load them back, so that a new process starts warm
+"""
+
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+import dns.name
+import dns.rdataclass
+import dns.rdatatype
+from rrcache import NODATA, NXDOMAIN
+
+MAGIC = b"DNSSNAP2"
+# expires (seconds since the epoch), kind, rdtype, rdclass, name length,
+# data length; followed by the owner name and the data. The data of a
+# negative answer is its SOA: the owner name, then the packed rdatas.
+HEADER = struct.Struct("!dBHHBI")
+# what a record holds
+RRSET, NEGATIVE_NXDOMAIN, NEGATIVE_NODATA, ZONE, GLUE = range(5)
+
+
+def name_from_wire(wire: bytes, pos: int = 0):
+    """
+    return (name, end) for the uncompressed wire-format name at pos
+    """
+    labels = []
+    while True:
+        length = wire[pos]
+        labels.append(wire[pos + 1:pos + 1 + length])
+        pos += 1 + length
+        if length == 0:
+            return dns.name.Name(labels), pos
+
+
+def record(expires, kind, rdtype, rdclass, name_wire, data) -> bytes:
+    """
+    one record of the snapshot file
+    """
+    return (HEADER.pack(expires, kind, rdtype, rdclass, len(name_wire),
+                        len(data)) + name_wire + data)
+
+
+def save(path: str, records, delegations) -> int:
+    """
+    write every live entry of records (a RecordCache) and delegations (a
+    DelegationCache) to path, return how many were written. The file is
+    replaced atomically, so readers see either the old or the new one.
+    """
+    now = time.time()
+    parts = [MAGIC]
+    for name_wire, rdtype, rdclass, ttl, value, soa in records.items():
+        soa_data = b"".join(soa) if soa is not None else b""
+        if isinstance(value, bytes):
+            parts.append(record(now + ttl, RRSET, rdtype, rdclass,
+                                name_wire, value))
+        elif value == NXDOMAIN:
+            parts.append(record(now + ttl, NEGATIVE_NXDOMAIN, rdtype,
+                                rdclass, name_wire, soa_data))
+        elif value == NODATA:
+            parts.append(record(now + ttl, NEGATIVE_NODATA, rdtype, rdclass,
+                                name_wire, soa_data))
+    for rdtype, name, ttl, value in delegations.items():
+        if rdtype == dns.rdatatype.NS:
+            data = b"".join(ns_name.to_wire() for ns_name in value)
+            kind = ZONE
+        else:
+            data = b"".join(socket.inet_aton(address) for address in value)
+            kind = GLUE
+        parts.append(record(now + ttl, kind, rdtype, dns.rdataclass.IN,
+                            name.to_wire(), data))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(dir=directory, prefix=".snapshot-",
+                                     delete=False) as out:
+        try:
+            out.write(b"".join(parts))
+            out.flush()
+            os.fsync(out.fileno())
+        except OSError:
+            os.unlink(out.name)
+            raise
+    os.replace(out.name, path)
+    return len(parts) - 1
+
+
+def load(path: str, records, delegations) -> int:
+    """
+    add the unexpired entries saved in path to records and delegations,
+    return how many were added. Records are decoded on first use; a
+    truncated file loads up to the damage.
+    """
+    with open(path, "rb") as snapshot_file:
+        data = snapshot_file.read()
+    if not data.startswith(MAGIC):
+        print(f"{path} is not a cache snapshot")
+        return 0
+
+    now = time.time()
+    entries = []
+    cuts = 0
+    pos = len(MAGIC)
+    while pos < len(data):
+        try:
+            (expires, kind, rdtype, rdclass, name_length,
+             data_length) = HEADER.unpack_from(data, pos)
+        except struct.error:
+            break
+        pos += HEADER.size
+        name_wire = data[pos:pos + name_length]
+        value = data[pos + name_length:pos + name_length + data_length]
+        pos += name_length + data_length
+        if pos > len(data):
+            break
+        ttl = expires - now
+        if ttl <= 0:
+            continue
+
+        if kind == RRSET:
+            entries.append((name_wire, rdtype, rdclass, ttl, value, None))
+        elif kind in (NEGATIVE_NXDOMAIN, NEGATIVE_NODATA):
+            soa = None
+            if value:
+                soa_end = name_from_wire(value)[1]
+                soa = (value[:soa_end], value[soa_end:])
+            entries.append((name_wire, rdtype, rdclass, ttl,
+                            NXDOMAIN if kind == NEGATIVE_NXDOMAIN else NODATA,
+                            soa))
+        elif kind == ZONE:
+            ns_names, ns_pos = [], 0
+            while ns_pos < len(value):
+                ns_name, ns_pos = name_from_wire(value, ns_pos)
+                ns_names.append(ns_name)
+            delegations.restore(rdtype, name_from_wire(name_wire)[0], ttl,
+                                ns_names)
+            cuts += 1
+        elif kind == GLUE:
+            delegations.restore(rdtype, name_from_wire(name_wire)[0], ttl, [
+                socket.inet_ntoa(value[i:i + 4])
+                for i in range(0, len(value), 4)])
+            cuts += 1
+    records.restore(entries)
+    return len(entries) + cuts
+
+
+def save_every(path: str, interval: float, records, delegations):
+    """
+    save a snapshot to path every interval seconds from a daemon thread,
+    return the thread
+    """
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                save(path, records, delegations)
+            except OSError as error:
+                print(f"Cannot save cache snapshot: {error}")
+
+    thread = threading.Thread(target=run, name="snapshot", daemon=True)
+    thread.start()
+    return thread
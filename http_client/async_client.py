@@ -0,0 +1,168 @@
+"""
+asyncio bulk fetcher built on the hw1 request builder and response parser
+"""
+import asyncio
+import collections
+import ssl
+import sys
+import time
+
+from hw1 import (ACCEPT_ENCODING, BUFSIZE, DEFAULT_TIMEOUT, ConnectionClosed,
+                 ProtocolError, ResponseParser, build_request, split_url)
+from resolver import CONNECTION_ATTEMPT_DELAY
+
+FetchResult = collections.namedtuple("FetchResult", "url status body error")
+
+
+class AsyncHTTPClient:
+    """
+    asyncio counterpart of hw1.HTTPClient: keep-alive connections pooled
+    per (scheme, host, port), with at most per_host_limit requests in
+    flight to one origin. Like a socket timeout, timeout bounds each
+    connect, write and read, not the time spent waiting for a slot.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, per_host_limit=6,
+                 idle_timeout=30):
+        self.timeout = timeout
+        self.per_host_limit = per_host_limit
+        self.idle_timeout = idle_timeout
+        self.ssl_context = ssl.create_default_context()
+        self._idle = {}  # (scheme, host, port) -> [(reader, writer, last_used)]
+        self._host_slots = {}  # (scheme, host, port) -> asyncio.Semaphore
+
+    async def _acquire(self, key):
+        """
+        return (reader, writer, reused) for the origin
+        """
+        idle = self._idle.get(key, [])
+        now = time.monotonic()
+        while idle:
+            reader, writer, last_used = idle.pop()
+            if (now - last_used <= self.idle_timeout
+                    and not reader.at_eof() and not writer.is_closing()):
+                return reader, writer, True
+            writer.close()
+        scheme, host, port = key
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(
+            host, port,
+            ssl=self.ssl_context if scheme == 'https' else None,
+            limit=BUFSIZE, happy_eyeballs_delay=CONNECTION_ATTEMPT_DELAY),
+            self.timeout)
+        return reader, writer, False
+
+    def _release(self, key, reader, writer):
+        idle = self._idle.setdefault(key, [])
+        if len(idle) < self.per_host_limit:
+            idle.append((reader, writer, time.monotonic()))
+        else:
+            writer.close()
+
+    async def request(self, url, method="GET", headers=None):
+        """
+        send one request and return its hw1.Response with the whole body
+        """
+        scheme, host, port, path = split_url(url)
+        key = (scheme, host, port)
+        headers = dict(headers or {})
+        headers.setdefault("Accept-Encoding", ACCEPT_ENCODING)
+        message = build_request(method, host, port, path, headers)
+        slots = self._host_slots.setdefault(
+            key, asyncio.Semaphore(self.per_host_limit))
+        async with slots:
+            while True:
+                reader, writer, reused = await self._acquire(key)
+                parser = ResponseParser(method, decode_content=True)
+                pieces = []
+                try:
+                    writer.write(message)
+                    await asyncio.wait_for(writer.drain(), self.timeout)
+                    while not parser.done:
+                        data = await asyncio.wait_for(reader.read(BUFSIZE),
+                                                      self.timeout)
+                        if not data:
+                            pieces.extend(parser.feed_eof())
+                        else:
+                            pieces.extend(parser.feed(data))
+                except (ConnectionClosed, ConnectionError):
+                    writer.close()
+                    if reused:
+                        continue  # stale keep-alive socket, try a fresh one
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                if parser.keep_alive and not parser.tail:
+                    self._release(key, reader, writer)
+                else:
+                    writer.close()
+                response = parser.response
+                response.body = b"".join(pieces)
+                return response
+
+    async def fetch(self, url):
+        """
+        return a FetchResult whose body is set only for 200 OK, like
+        hw1.retrieve_url
+        """
+        try:
+            response = await self.request(url)
+        except asyncio.TimeoutError:
+            return FetchResult(url, None, None, "timeout")
+        except ssl.SSLError as e:
+            return FetchResult(url, None, None, f"SSL error - {e}")
+        except (ProtocolError, OSError) as e:
+            return FetchResult(url, None, None, str(e))
+        body = response.body if response.status == 200 else None
+        return FetchResult(url, response.status, body, None)
+
+    def close(self):
+        """
+        close every pooled connection
+        """
+        for idle in self._idle.values():
+            for _, writer, _ in idle:
+                writer.close()
+        self._idle.clear()
+
+
+async def retrieve_urls(urls, concurrency=100, per_host_limit=6,
+                        timeout=DEFAULT_TIMEOUT):
+    """
+    fetch urls concurrently and yield a FetchResult for each as soon as it
+    completes. urls may be any iterable, at most concurrency fetches are
+    in flight at once.
+    """
+    client = AsyncHTTPClient(timeout=timeout, per_host_limit=per_host_limit)
+    pending = set()
+    urls = iter(urls)
+    try:
+        while True:
+            for url in urls:
+                pending.add(asyncio.ensure_future(client.fetch(url)))
+                if len(pending) >= concurrency:
+                    break
+            if not pending:
+                break
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        client.close()
+
+
+async def _main(urls):
+    async for result in retrieve_urls(urls):
+        if result.error:
+            print(f"{result.url}: Error: {result.error}")
+        elif result.body is None:
+            print(f"{result.url}: {result.status}, no body")
+        else:
+            print(f"{result.url}: {result.status}, {len(result.body)} bytes")
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(sys.argv[1:]))
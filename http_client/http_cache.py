@@ -0,0 +1,200 @@
+"""
+size-bounded on-disk HTTP response cache with conditional revalidation
+"""
+import collections
+import email.utils
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+# headers of a 304 that describe the empty 304 body, not the cached one
+UNCACHED_HEADERS = ("content-length", "content-encoding", "transfer-encoding",
+                    "connection", "keep-alive")
+
+
+def parse_cache_control(value):
+    """
+    return {directive: argument or None} for a Cache-Control header
+    """
+    directives = {}
+    for item in value.split(","):
+        name, _, arg = item.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"') or None
+    return directives
+
+
+def freshness_lifetime(headers, now):
+    """
+    return the absolute time until which a response with headers is
+    fresh, from Cache-Control max-age or else Expires
+    """
+    directives = parse_cache_control(headers.get("cache-control", ""))
+    if "no-cache" in directives:
+        return now
+    try:
+        age = int(headers.get("age", 0))
+    except ValueError:
+        age = 0
+    if directives.get("max-age") is not None:
+        try:
+            return now + int(directives["max-age"]) - age
+        except ValueError:
+            return now
+    if "expires" in headers:
+        try:
+            expires = email.utils.parsedate_to_datetime(headers["expires"])
+            date = email.utils.parsedate_to_datetime(
+                headers.get("date", headers["expires"]))
+        except (TypeError, ValueError):
+            return now  # an invalid Expires means already expired
+        # Expires is relative to the server's clock, not ours
+        return now + (expires - date).total_seconds() - age
+    return now
+
+
+class CacheEntry:
+    """
+    metadata and body of one cached response
+    """
+
+    def __init__(self, url, status, reason, headers, body, expires):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self.expires = expires
+
+    def is_fresh(self, now=None):
+        """
+        True if the entry can be served without asking the server
+        """
+        return (time.time() if now is None else now) < self.expires
+
+    def validators(self):
+        """
+        return the headers of a conditional request for this entry
+        """
+        headers = {}
+        if "etag" in self.headers:
+            headers["If-None-Match"] = self.headers["etag"]
+        if "last-modified" in self.headers:
+            headers["If-Modified-Since"] = self.headers["last-modified"]
+        return headers
+
+
+class DiskCache:
+    """
+    responses stored one file per URL under directory, evicted least
+    recently used first once they take more than max_bytes
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "revalidations": 0,
+                      "evictions": 0}
+        self._sizes = collections.OrderedDict()  # file name -> size, LRU first
+        self._total = 0
+        os.makedirs(directory, exist_ok=True)
+        files = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith(".tmp"):
+                os.remove(path)  # left over from an interrupted store
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._sizes[name] = size
+            self._total += size
+
+    @staticmethod
+    def _name(url):
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def get(self, url):
+        """
+        return the CacheEntry for url, fresh or stale, or None
+        """
+        name = self._name(url)
+        if name not in self._sizes:
+            return None
+        try:
+            with open(self._path(name), "rb") as f:
+                meta = json.loads(f.readline())
+                body = f.read()
+        except (OSError, ValueError):
+            self._remove(name)
+            return None
+        if meta["url"] != url:
+            return None  # hash collision
+        self._sizes.move_to_end(name)
+        os.utime(self._path(name))  # recency survives a restart
+        return CacheEntry(url, meta["status"], meta["reason"],
+                          meta["headers"], body, meta["expires"])
+
+    def put(self, url, status, reason, headers, body):
+        """
+        store a 200 response unless its headers forbid it, return the
+        CacheEntry or None
+        """
+        directives = parse_cache_control(headers.get("cache-control", ""))
+        entry = CacheEntry(url, status, reason, headers, body,
+                           freshness_lifetime(headers, time.time()))
+        if (status != 200 or "no-store" in directives
+                or headers.get("vary", "").strip() == "*"
+                or not entry.is_fresh() and not entry.validators()):
+            self._remove(self._name(url))  # drop what this replaces
+            return None
+        self._write(entry)
+        return entry
+
+    def refresh(self, entry, headers):
+        """
+        a 304 confirmed entry, merge the new headers and extend its life
+        """
+        entry.headers.update(
+            (name, value) for name, value in headers.items()
+            if name not in UNCACHED_HEADERS)
+        entry.expires = freshness_lifetime(entry.headers, time.time())
+        self._write(entry)
+        return entry
+
+    def _write(self, entry):
+        """
+        store entry in its file, then evict until under max_bytes
+        """
+        meta = json.dumps({"url": entry.url, "status": entry.status,
+                           "reason": entry.reason, "headers": entry.headers,
+                           "expires": entry.expires}).encode()
+        size = len(meta) + 1 + len(entry.body)
+        if size > self.max_bytes:
+            return
+        name = self._name(entry.url)
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(meta + b"\n")
+            f.write(entry.body)
+        os.replace(tmp, self._path(name))
+        self._total += size - self._sizes.pop(name, 0)
+        self._sizes[name] = size
+        while self._total > self.max_bytes:
+            self._remove(next(iter(self._sizes)))
+            self.stats["evictions"] += 1
+
+    def _remove(self, name):
+        """
+        forget the file name and delete it
+        """
+        self._total -= self._sizes.pop(name, 0)
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
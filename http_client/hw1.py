@@ -1,94 +1,876 @@
 """
-HTTP client 1.0
+HTTP client 1.1
 """
+import contextlib
+import select
 import socket
 import sys
 import ssl
+import threading
+import time
+import zlib
 from urllib.parse import urlparse
 
+from http_cache import DiskCache
+from latency import Timing
+from resolver import CachingResolver, connect_happy_eyeballs
 
-def retrieve_url(url):
+DEFAULT_TIMEOUT = 10  # Set the timeout duration in seconds
+MAX_LINE = 65536  # Longest status or header line we accept
+MAX_HEAD = 262144  # Longest response head we accept
+BUFSIZE = 65536  # Size of the receive buffer of each connection
+ACCEPT_ENCODING = "gzip, deflate"  # Content codings ContentDecoder handles
+
+
+class ProtocolError(Exception):
+    """
+    the server sent something that is not a valid HTTP/1.x response
     """
-    return bytes of the body of the document at url
+
+
+class ConnectionClosed(ProtocolError):
+    """
+    the server closed the connection before sending a status line
+    """
+
+
+class Response:
     """
+    status, headers and body of one HTTP response. A streamed response
+    has body None and hands out its body through iter_body()
+    """
+
+    def __init__(self, version, status, reason, headers, body=None):
+        self.version = version
+        self.status = status
+        self.reason = reason
+        self.headers = headers  # header names are lower case
+        self.body = body
+        self.timing = None  # latency.Timing of the request, if measured
+        self._chunks = None
+
+    def iter_body(self):
+        """
+        yield the body in pieces of at most one receive buffer
+        """
+        if self.body is not None:
+            yield self.body
+        elif self._chunks is not None:
+            chunks, self._chunks = self._chunks, None
+            yield from chunks
+
+
+def split_url(url):
+    """
+    return (scheme, host, port, path) for url
+    """
+    parsed_url = urlparse(url)
+    host = parsed_url.hostname
+    path = parsed_url.path if parsed_url.path else "/"
+    port = (
+        parsed_url.port if parsed_url.port
+        else (443 if parsed_url.scheme == 'https' else 80)
+        )
+    return parsed_url.scheme, host, port, path
+
+
+def build_request(method, host, port, path, headers=None):
+    """
+    return the bytes of an HTTP/1.1 request
+    """
+    message = f"{method} {path} HTTP/1.1\r\n".encode()
+    message += f"Host: {host}:{port}\r\n".encode()
+    for name, value in (headers or {}).items():
+        message += f"{name}: {value}\r\n".encode()
+    message += b"\r\n"
+    return message
+
+
+def parse_headers(lines):
+    """
+    return a dict keyed by lower case header name, repeated headers are
+    joined with a comma
+    """
+    headers = {}
+    for line in lines:
+        if len(line) > MAX_LINE:
+            raise ProtocolError("header line too long")
+        name, sep, value = line.decode("latin-1").partition(":")
+        if not sep:
+            raise ProtocolError(f"malformed header line {line!r}")
+        name = name.strip().lower()
+        value = value.strip()
+        headers[name] = f"{headers[name]}, {value}" if name in headers else value
+    return headers
+
+
+def parse_head(head):
+    """
+    parse the status line and headers (without the blank line)
+    """
+    status_line, *lines = head.split(b"\r\n")
     try:
-        parsed_url = urlparse(url)
-        host = parsed_url.hostname
-        path = parsed_url.path if parsed_url.path else "/"
-        port = (
-            parsed_url.port if parsed_url.port
-            else (443 if parsed_url.scheme == 'https' else 80)
-            )
-        timeout = 10  # Set the timeout duration in seconds
-
-        # Construct header
-        message = f"GET {path} HTTP/1.1\r\n".encode()
-        message += f"Host: {host}:{port}\r\n".encode()
-        message += b"Connection: close\r\n"
-        message += b"\r\n"
-
-        # Start a socket connection
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(timeout)
-            try:
-                # Handle https
-                if parsed_url.scheme == 'https':
-                    context = ssl.create_default_context()
-                    s = context.wrap_socket(s, server_hostname=host)
-
-                s.connect((host, port))
-                print(f"Connected to {host}:{port}")
-            except socket.timeout as e:
-                print(f"Error: Timeout when connecting to {host}:{port} - {e}")
-                return None
-            except socket.gaierror as e:
-                print(f"Error: DNS failed for {host}:{port} - {e}")
-                return None
-            except ssl.SSLError as e:
-                print(f"Error: SSL error - {e}")
-                return None
+        version, status, reason = (status_line.decode("latin-1")
+                                   .split(" ", 2) + [""])[:3]
+        status = int(status)
+    except ValueError as exc:
+        raise ProtocolError(f"malformed status line {status_line!r}") from exc
+    if not version.startswith("HTTP/"):
+        raise ProtocolError(f"malformed status line {status_line!r}")
+    return Response(version, status, reason, parse_headers(lines))
+
 
-            # Send an HTTP GET request
-            s.sendall(message)
-            # Receive the response
-            res = b''
-            while True:
+class ChunkedDecoder:
+    """
+    incremental decoder for the chunked transfer coding. feed() takes
+    whatever bytes arrived and returns the decoded pieces, so chunk size
+    lines and chunk data may be split across any number of reads.
+    """
+
+    SIZE, DATA, DATA_END, TRAILER, DONE = range(5)
+
+    def __init__(self):
+        self.state = self.SIZE
+        self.remaining = 0  # bytes left in the current chunk
+        self.line = bytearray()  # partial size, CRLF or trailer line
+        self.tail = b""  # bytes after the end of the body
+
+    @property
+    def done(self):
+        """
+        True once the last chunk and the trailer section were read
+        """
+        return self.state == self.DONE
+
+    def _line(self, data, pos):
+        """
+        return (line, new position) or (None, len(data)) if the line is
+        not complete yet
+        """
+        newline = data.find(b"\n", pos)
+        if newline == -1:
+            self.line += data[pos:]
+            if len(self.line) > MAX_LINE:
+                raise ProtocolError("chunk line too long")
+            return None, len(data)
+        line = data[pos:newline + 1]
+        if self.line:
+            line = bytes(self.line) + line
+            self.line.clear()
+        return line, newline + 1
+
+    def feed(self, data):
+        """
+        decode data, return a list of body pieces
+        """
+        pieces = []
+        pos = 0
+        end = len(data)
+        while pos < end and self.state != self.DONE:
+            if self.state == self.DATA:
+                take = min(self.remaining, end - pos)
+                pieces.append(data[pos:pos + take])
+                pos += take
+                self.remaining -= take
+                if not self.remaining:
+                    self.state = self.DATA_END
+                continue
+            line, pos = self._line(data, pos)
+            if line is None:
+                break
+            if self.state == self.SIZE:
                 try:
-                    chunk = s.recv(4096)
-                    if not chunk:
-                        break
-                    res += chunk
-                except socket.timeout:
-                    print("Error: Timeout while receiving data")
-                    return None
-            header, body = res.split(b"\r\n\r\n", 1)
-            if (b"301 Moved Permanently" in header or
-                    b"302 Found" in header):  # handle redirect
-                return None
-            if b'Transfer-Encoding: chunked' in header:  # handle chunked data
-                decoded_body = b''
-                while True:
-                    index = body.find(b'\r\n')
-                    if index == -1:
-                        break
-                    length = int(body[:index].decode(), 16)
-                    if length == 0:
-                        break
-                    start = index + 2
-                    end = start + length
-                    decoded_body += body[start:end]
-                    body = body[end+2:]
-                return decoded_body
-            if b'200 OK' in header:  # only return body when 200 OK
-                return body
-            else:
+                    size = int(line.split(b";", 1)[0].strip(), 16)
+                except ValueError as exc:
+                    raise ProtocolError(f"bad chunk size {line!r}") from exc
+                if size:
+                    self.state, self.remaining = self.DATA, size
+                else:
+                    self.state = self.TRAILER
+            elif self.state == self.DATA_END:
+                if line.strip():
+                    raise ProtocolError("missing CRLF after chunk data")
+                self.state = self.SIZE
+            elif not line.strip():  # blank line ends the trailer section
+                self.state = self.DONE
+        if self.state == self.DONE:
+            self.tail = data[pos:]
+        return pieces
+
+
+class ContentDecoder:
+    """
+    incremental decoder for a gzip or deflate Content-Encoding, fed the
+    body pieces left after the transfer coding was removed
+    """
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self._obj = None
+        self._start = b""  # first bytes of a deflate body, see _open
+        if encoding != "deflate":
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def _open(self, data):
+        """
+        "deflate" should be zlib wrapped, but some servers send raw
+        deflate. The first two bytes tell which one this is.
+        """
+        self._start += data
+        if len(self._start) < 2:
+            return b""
+        cmf, flg = self._start[0], self._start[1]
+        zlib_wrapped = cmf & 0x0f == 8 and (cmf << 8 | flg) % 31 == 0
+        wbits = zlib.MAX_WBITS if zlib_wrapped else -zlib.MAX_WBITS
+        self._obj = zlib.decompressobj(wbits)
+        data, self._start = self._start, b""
+        return self._obj.decompress(data)
+
+    def feed(self, data):
+        """
+        return the decoded bytes of data
+        """
+        try:
+            if self._obj is None:
+                return self._open(data)
+            out = self._obj.decompress(data)
+            while self._obj.eof and self._obj.unused_data:
+                # gzip bodies may hold several members back to back
+                rest = self._obj.unused_data
+                self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                out += self._obj.decompress(rest)
+            return out
+        except zlib.error as exc:
+            raise ProtocolError(f"bad {self.encoding} body - {exc}") from exc
+
+    def flush(self):
+        """
+        return whatever the decompressor still holds at the end of the body
+        """
+        if self._obj is None:
+            if self._start:
+                raise ProtocolError(f"truncated {self.encoding} body")
+            return b""
+        out = self._obj.flush()
+        if not self._obj.eof:
+            raise ProtocolError(f"truncated {self.encoding} body")
+        return out
+
+
+class ResponseParser:
+    """
+    incremental parser for one HTTP/1.x response. feed() returns body
+    pieces; response is set once the head was parsed and done once the
+    body is complete. Bytes that arrived after the end of this response
+    are kept in tail. With decode_content a gzip or deflate body is
+    decompressed as it arrives.
+    """
+
+    def __init__(self, method="GET", decode_content=False):
+        self.method = method
+        self.decode_content = decode_content
+        self.response = None
+        self.keep_alive = True
+        self.done = False
+        self.tail = b""
+        self._head = bytearray()
+        self._remaining = None  # Content-Length bytes still to come
+        self._chunked = None
+        self._until_eof = False
+        self._decoder = None
+
+    def _start_body(self, response):
+        """
+        decide how the body of response is framed
+        """
+        headers = response.headers
+        connection = headers.get("connection", "").lower()
+        if response.version == "HTTP/1.0":
+            self.keep_alive = "keep-alive" in connection
+        else:
+            self.keep_alive = "close" not in connection
+
+        if self.method == "HEAD" or response.status in (204, 304):
+            self.done = True
+        elif "chunked" in headers.get("transfer-encoding", "").lower():
+            self._chunked = ChunkedDecoder()
+        elif "content-length" in headers:
+            try:
+                self._remaining = int(headers["content-length"])
+            except ValueError as exc:
+                raise ProtocolError("bad Content-Length") from exc
+            self.done = not self._remaining
+        else:
+            self._until_eof = True  # no framing, the body ends at EOF
+            self.keep_alive = False
+        encoding = headers.get("content-encoding", "").strip().lower()
+        if (self.decode_content and not self.done
+                and encoding in ("gzip", "x-gzip", "deflate")):
+            self._decoder = ContentDecoder(encoding)
+        self.response = response
+
+    def _feed_head(self, data):
+        """
+        buffer head bytes, return the offset in data where the body
+        starts or None if the head is still incomplete
+        """
+        start = max(len(self._head) - 3, 0)
+        self._head += data
+        while True:
+            end = self._head.find(b"\r\n\r\n", start)
+            if end == -1:
+                if len(self._head) > MAX_HEAD:
+                    raise ProtocolError("response head too long")
                 return None
-    except socket.timeout:
-        print("Error: Timeout while receiving data")
-        return None
-    except ssl.SSLError as e:
+            response = parse_head(bytes(self._head[:end]))
+            rest = self._head[end + 4:]
+            if 100 <= response.status < 200 and response.status != 101:
+                self._head = rest  # skip interim 1xx responses
+                start = 0
+                continue
+            self._head = None
+            self._start_body(response)
+            return len(data) - len(rest)
+
+    def _decode(self, pieces):
+        """
+        run body pieces through the content decoder, if there is one
+        """
+        if self._decoder is None:
+            return pieces
+        out = [self._decoder.feed(piece) for piece in pieces]
+        if self.done:
+            out.append(self._decoder.flush())
+        return [piece for piece in out if piece]
+
+    def feed(self, data):
+        """
+        parse the next bytes received from the server
+        """
+        return self._decode(self._feed_framed(bytes(data)))
+
+    def _feed_framed(self, data):
+        """
+        split data into head and body, return the body pieces with the
+        transfer coding removed
+        """
+        pos = 0
+        if self.response is None:
+            pos = self._feed_head(data)
+            if pos is None:
+                return []
+        if self.done:
+            self.tail = data[pos:]
+            return []
+        if self._chunked is not None:
+            pieces = self._chunked.feed(data[pos:] if pos else data)
+            if self._chunked.done:
+                self.done = True
+                self.tail = self._chunked.tail
+            return pieces
+        if self._until_eof:
+            return [data[pos:]] if pos < len(data) else []
+        take = min(self._remaining, len(data) - pos)
+        piece = data[pos:pos + take]
+        self._remaining -= take
+        if not self._remaining:
+            self.done = True
+            self.tail = data[pos + take:]
+        return [piece] if piece else []
+
+    def feed_eof(self):
+        """
+        the server closed the connection, return the last body pieces
+        """
+        if self._until_eof:
+            self.done = True
+            return self._decode([])
+        elif self.response is None and not self._head:
+            raise ConnectionClosed("connection closed before status line")
+        elif not self.done:
+            raise ProtocolError("connection closed inside response")
+        return []
+
+
+class Connection:
+    """
+    one TCP (or TLS) connection to an origin that may be reused. Reads go
+    through recv_into on one preallocated buffer.
+    """
+
+    def __init__(self, sock, key, bufsize=BUFSIZE):
+        self.sock = sock
+        self.key = key
+        self.last_used = time.monotonic()
+        self.reused = False
+        self.pending = b""  # bytes received past the previous response
+        self.timing = None  # latency.Timing of the request in flight
+        self._buffer = bytearray(bufsize)
+        self._view = memoryview(self._buffer)
+
+    def _fill(self, parser):
+        """
+        receive once and feed the parser, return body pieces
+        """
+        n = self.sock.recv_into(self._buffer)
+        if self.timing is not None:
+            self.timing.received(n)
+        if not n:
+            return parser.feed_eof()
+        return parser.feed(self._view[:n])
+
+    def start_response(self, method="GET", decode_content=False):
+        """
+        read until the head of the next response was parsed, return the
+        parser and the body pieces that arrived with the head
+        """
+        parser = ResponseParser(method, decode_content)
+        pieces = []
+        if self.pending:
+            pending, self.pending = self.pending, b""
+            pieces = parser.feed(pending)
+        while parser.response is None:
+            pieces = self._fill(parser)
+        return parser, pieces
+
+    def iter_body(self, parser, pieces):
+        """
+        yield body pieces until the parser saw the end of the response
+        """
+        yield from pieces
+        while not parser.done:
+            yield from self._fill(parser)
+        self.pending = parser.tail
+
+    def is_dropped(self):
+        """
+        an idle keep-alive socket becomes readable only when the server
+        closed it (or sent garbage), either way it can not be reused
+        """
+        if self.pending:
+            return True
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def close(self):
+        """
+        close the socket
+        """
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class HTTPClient:
+    """
+    an HTTP/1.1 client that keeps a pool of keep-alive connections per
+    (scheme, host, port) and reuses TLS sessions for new connections
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_idle_per_host=4,
+                 idle_timeout=30, decode_content=True, cache=None,
+                 timing_hook=None, resolver=None):
+        self.timeout = timeout
+        # a resolver.CachingResolver or anything with the same interface
+        self.resolver = resolver or CachingResolver()
+        # called with the latency.Timing of every request that completes,
+        # e.g. latency.LatencyHistogram().add
+        self.timing_hook = timing_hook
+        self.decode_content = decode_content
+        self.cache = cache  # an http_cache.DiskCache, or None
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self.ssl_context = ssl.create_default_context()
+        self._idle = {}  # (scheme, host, port) -> [Connection]
+        self._tls_sessions = {}  # (host, port) -> ssl.SSLSession
+        self._lock = threading.Lock()
+
+    def _connect(self, scheme, host, port, timing):
+        """
+        open a new connection, resuming a cached TLS session if we have
+        one. DNS, TCP connect and TLS handshake are timed separately.
+        IPv6 and IPv4 addresses are raced, so one dead path costs only
+        the connection attempt delay.
+        """
+        addresses = self.resolver.resolve(host, port)
+        timing.mark("dns_done")
+        try:
+            s = connect_happy_eyeballs(addresses, self.timeout)
+        except OSError:
+            self.resolver.forget(host)  # the host may have moved
+            raise
+        s.settimeout(self.timeout)
+        try:
+            timing.mark("connect_done")
+            # Handle https
+            if scheme == 'https':
+                s = self.ssl_context.wrap_socket(
+                    s, server_hostname=host,
+                    session=self._tls_sessions.get((host, port)))
+                timing.mark("tls_done")
+        except BaseException:
+            s.close()
+            raise
+        print(f"Connected to {host}:{port}")
+        return Connection(s, (scheme, host, port))
+
+    def acquire(self, scheme, host, port, timing=None):
+        """
+        return an idle pooled connection to the origin, or a new one
+        """
+        if timing is None:
+            timing = Timing()
+        key = (scheme, host, port)
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                conn = idle.pop()
+                if (now - conn.last_used <= self.idle_timeout
+                        and not conn.is_dropped()):
+                    conn.reused = timing.reused = True
+                    return conn
+                conn.close()
+        return self._connect(scheme, host, port, timing)
+
+    def release(self, conn):
+        """
+        put a connection whose response was fully read back in the pool
+        """
+        scheme, host, port = conn.key
+        if scheme == 'https':
+            session = conn.sock.session
+            if session is not None:
+                self._tls_sessions[(host, port)] = session
+        conn.last_used = time.monotonic()
+        with self._lock:
+            idle = self._idle.setdefault(conn.key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def evict_idle(self):
+        """
+        close pooled connections that sat idle longer than idle_timeout
+        """
+        now = time.monotonic()
+        with self._lock:
+            for key, idle in list(self._idle.items()):
+                keep = []
+                for conn in idle:
+                    if now - conn.last_used <= self.idle_timeout:
+                        keep.append(conn)
+                    else:
+                        conn.close()
+                if keep:
+                    self._idle[key] = keep
+                else:
+                    del self._idle[key]
+
+    def close(self):
+        """
+        close every pooled connection
+        """
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _headers(self, headers):
+        """
+        add Accept-Encoding to the caller's request headers unless they
+        set their own, or content decoding is off
+        """
+        headers = dict(headers or {})
+        if self.decode_content and not any(
+                name.lower() == "accept-encoding" for name in headers):
+            headers["Accept-Encoding"] = ACCEPT_ENCODING
+        return headers
+
+    def _send(self, url, method, headers):
+        """
+        send one request and read the head of its response. A reused
+        connection that turns out to be closed by the server is retried
+        once on a new one.
+        """
+        scheme, host, port, path = split_url(url)
+        message = build_request(method, host, port, path,
+                                self._headers(headers))
+        while True:
+            timing = Timing()
+            conn = self.acquire(scheme, host, port, timing)
+            conn.timing = timing
+            try:
+                conn.sock.sendall(message)
+                timing.mark("sent")
+                parser, pieces = conn.start_response(method,
+                                                     self.decode_content)
+            except (ConnectionClosed, ConnectionError):
+                conn.close()
+                if conn.reused:
+                    continue  # stale keep-alive socket, try a fresh one
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            return conn, parser, pieces
+
+    @contextlib.contextmanager
+    def stream(self, url, method="GET", headers=None):
+        """
+        send one request and yield its Response with the body not read
+        yet, iterate response.iter_body() to receive it. The connection
+        goes back to the pool only if the whole body was read.
+        """
+        conn, parser, pieces = self._send(url, method, headers)
+        response = parser.response
+        response.timing = conn.timing
+        response._chunks = conn.iter_body(  # pylint: disable=protected-access
+            parser, pieces)
+        try:
+            yield response
+        except BaseException:
+            conn.close()
+            raise
+        finally:
+            conn.timing = None
+        if parser.done:
+            response.timing.mark("end")
+            if self.timing_hook is not None:
+                self.timing_hook(response.timing)
+        if parser.done and parser.keep_alive and not conn.pending:
+            self.release(conn)
+        else:
+            conn.close()
+
+    def request(self, url, method="GET", headers=None):
+        """
+        send one request and return its Response with the whole body.
+        Plain GETs go through the cache, if there is one.
+        """
+        if self.cache is not None and method == "GET" and not headers:
+            return self._cached_get(url)
+        return self._request(url, method, headers)
+
+    def _cached_get(self, url):
+        """
+        serve a fresh cache entry without touching the network, revalidate
+        a stale one and store what the server sends
+        """
+        stats = self.cache.stats
+        entry = self.cache.get(url)
+        if entry is not None and entry.is_fresh():
+            stats["hits"] += 1
+            return entry_response(entry)
+        validators = entry.validators() if entry is not None else {}
+        if validators:
+            stats["revalidations"] += 1
+        response = self._request(url, "GET", validators)
+        if response.status == 304 and validators:
+            stats["hits"] += 1
+            cached = entry_response(self.cache.refresh(entry,
+                                                       response.headers))
+            cached.timing = response.timing
+            return cached
+        stats["misses"] += 1
+        self.cache.put(url, response.status, response.reason,
+                       response.headers, response.body)
+        return response
+
+    def _request(self, url, method, headers):
+        with self.stream(url, method, headers) as response:
+            response.body = b"".join(response.iter_body())
+        return response
+
+    def download(self, url, out, method="GET", headers=None):
+        """
+        write the body to the file or buffer out (anything with a write
+        method) as it arrives, return the Response without its body
+        """
+        with self.stream(url, method, headers) as response:
+            for piece in response.iter_body():
+                out.write(piece)
+        return response
+
+    def _pipeline_once(self, key, items, depth, results):
+        """
+        pipeline the GET requests for items, a list of (index, url) on one
+        origin, over one connection. Store each Response at its index in
+        results and return how many of items were answered before the
+        server closed the connection.
+        """
+        scheme, host, port = key
+        headers = self._headers(None)
+        requests = [build_request("GET", host, port, split_url(url)[3],
+                                  headers)
+                    for _, url in items]
+        done = 0
+        keep_alive = False
+        conn = self.acquire(scheme, host, port)
+        try:
+            sent = min(depth, len(items))
+            conn.sock.sendall(b"".join(requests[:sent]))
+            while done < len(items):
+                parser, pieces = conn.start_response(
+                    decode_content=self.decode_content)
+                response = parser.response
+                response.body = b"".join(conn.iter_body(parser, pieces))
+                results[items[done][0]] = response
+                done += 1
+                keep_alive = parser.keep_alive
+                if not keep_alive:
+                    break
+                if sent < len(items):  # keep depth requests in flight
+                    conn.sock.sendall(requests[sent])
+                    sent += 1
+        except (ConnectionClosed, ConnectionError):
+            keep_alive = False  # the server closed early
+        except BaseException:
+            conn.close()
+            raise
+        if keep_alive and not conn.pending:
+            self.release(conn)
+        else:
+            conn.close()
+        return done
+
+    def _pipeline_origin(self, key, items, depth, results):
+        """
+        pipeline items on as many connections as the server allows, and
+        fall back to sequential requests once a connection closes before
+        answering any of them
+        """
+        while items:
+            done = self._pipeline_once(key, items, depth, results)
+            if not done:
+                break
+            items = items[done:]
+        for index, url in items:
+            results[index] = self.request(url)
+
+    def pipeline(self, urls, depth=8):
+        """
+        GET every url, writing up to depth requests back to back on one
+        connection per origin, and return the Responses in the order of
+        urls
+        """
+        results = [None] * len(urls)
+        for key, items in group_by_origin(urls).items():
+            self._pipeline_origin(key, items, depth, results)
+        return results
+
+    def get(self, url, with_timing=False):
+        """
+        return bytes of the body of the document at url, or None unless
+        the server answered 200 OK. with_timing returns (body, Timing)
+        """
+        _, host, port, _ = split_url(url)
+        try:
+            response = self.request(url)
+        except (ProtocolError, OSError) as e:
+            report_error(host, port, e)
+            return (None, None) if with_timing else None
+        if with_timing:
+            return body_if_ok(response), response.timing
+        return body_if_ok(response)
+
+    def get_many(self, urls, depth=8):
+        """
+        pipelined get(): return the bodies of urls in order, each None
+        unless the server answered 200 OK
+        """
+        results = [None] * len(urls)
+        for key, items in group_by_origin(urls).items():
+            try:
+                self._pipeline_origin(key, items, depth, results)
+            except (ProtocolError, OSError) as e:
+                report_error(key[1], key[2], e)
+        return [body_if_ok(response) if response else None
+                for response in results]
+
+
+def group_by_origin(urls):
+    """
+    return {(scheme, host, port): [(index, url)]} for urls
+    """
+    origins = {}
+    for index, url in enumerate(urls):
+        scheme, host, port, _ = split_url(url)
+        origins.setdefault((scheme, host, port), []).append((index, url))
+    return origins
+
+
+def entry_response(entry):
+    """
+    return a Response for a http_cache.CacheEntry
+    """
+    response = Response("HTTP/1.1", entry.status, entry.reason,
+                        dict(entry.headers), entry.body)
+    response.timing = Timing()
+    response.timing.from_cache = True
+    response.timing.mark("end")
+    return response
+
+
+def report_error(host, port, e):
+    """
+    print why a request to host:port failed
+    """
+    if isinstance(e, socket.timeout):
+        print(f"Error: Timeout when talking to {host}:{port} - {e}")
+    elif isinstance(e, socket.gaierror):
+        print(f"Error: DNS failed for {host}:{port} - {e}")
+    elif isinstance(e, ssl.SSLError):
         print(f"Error: SSL error - {e}")
-        return None
+    else:
+        print(f"Error: {host}:{port} - {e}")
+
+
+def body_if_ok(response):
+    """
+    only return body when 200 OK, redirects and errors give None
+    """
+    return response.body if response.status == 200 else None
+
+
+_default_client = HTTPClient()
+
+
+def enable_cache(directory, max_bytes=256 * 1024 * 1024):
+    """
+    cache the responses retrieve_url gets in directory, return the
+    DiskCache so its stats can be read
+    """
+    _default_client.cache = DiskCache(directory, max_bytes)
+    return _default_client.cache
+
+
+def retrieve_url(url, with_timing=False):
+    """
+    return bytes of the body of the document at url, with_timing returns
+    (body, latency.Timing) to show where the time went
+    """
+    return _default_client.get(url, with_timing)
+
+
+def retrieve_urls_pipelined(urls, depth=8):
+    """
+    return the bodies of urls in order, pipelining requests to the same
+    origin on one connection
+    """
+    return _default_client.get_many(urls, depth)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,89 @@
+'''
+offline benchmark of retrieve_url across body sizes, against
+local_server.py running in a separate process
+
+    python hw1_bench.py [--requests N] [--sizes 1024,65536,...]
+'''
+import argparse
+import contextlib
+import io
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from hw1 import retrieve_url
+
+DEFAULT_SIZES = (1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024)
+ROUTES = ("size", "chunked")
+
+
+def peak_rss_mb():
+    '''
+    peak resident set size of this process so far (ru_maxrss is KiB on
+    Linux and bytes on macOS)
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def percentile(samples, q):
+    '''
+    nearest-rank percentile of a sorted list
+    '''
+    return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+
+def bench(url, requests):
+    '''
+    fetch url requests times, return the sorted latencies in seconds and
+    the total number of body bytes
+    '''
+    latencies = []
+    received = 0
+    for _ in range(requests):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):  # "Connected to"
+            body = retrieve_url(url)
+        latencies.append(time.perf_counter() - start)
+        if body is None:
+            raise RuntimeError(f"no body for {url}")
+        received += len(body)
+    return sorted(latencies), received
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20,
+                        help="requests per size and route")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="comma separated body sizes in bytes")
+    options = parser.parse_args(args)
+
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(__file__),
+                                      "local_server.py")],
+        stdout=subprocess.PIPE, text=True)
+    try:
+        base = server.stdout.readline().strip()
+        print(f"{'route':>8} {'size':>10} {'req/s':>9} {'MB/s':>9} "
+              f"{'p50 ms':>8} {'p99 ms':>8} {'peak RSS MB':>12}")
+        for size in map(int, options.sizes.split(",")):
+            for route in ROUTES:
+                latencies, received = bench(f"{base}/{route}/{size}",
+                                            options.requests)
+                elapsed = sum(latencies)
+                print(f"{route:>8} {size:>10} "
+                      f"{len(latencies) / elapsed:>9.1f} "
+                      f"{received / elapsed / 1e6:>9.1f} "
+                      f"{percentile(latencies, 50) * 1000:>8.2f} "
+                      f"{percentile(latencies, 99) * 1000:>8.2f} "
+                      f"{peak_rss_mb():>12.1f}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
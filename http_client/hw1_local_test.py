@@ -0,0 +1,77 @@
+'''
+offline test cases for the http client, against local_server.py
+'''
+import sys
+
+from hw1 import retrieve_url
+from local_server import body_for, start
+
+# (path, expected body); the server closes the connection after /close
+TEST_CASES = [('/size/0', b''),  # empty 200 body
+              ('/size/10', body_for(10)),
+              ('/size/5000000', body_for(5000000)),  # large
+              ('/chunked/3000000', body_for(3000000)),  # odd chunk sizes
+              ('/drip/2000', body_for(2000)),  # slow drip, many reads
+              ('/close/100000', body_for(100000)),  # ends at EOF
+              ('/gzip/200000', body_for(200000)),  # compressed on the wire
+              ('/redirect', None),  # 301
+              ('/doesnotexist', None),  # 404
+             ]
+
+
+def compare_output(base, path, expected, reuse=False):
+    '''
+    compare hw1.py output for base + path with the expected body, and with
+    reuse check that it went over a pooled connection; return True if
+    both hold
+    '''
+    url = base + path
+    try:
+        student_output, timing = retrieve_url(url, with_timing=True)
+    except Exception as exc:  # pylint: disable=broad-except
+        print("uncaught exception ({}) for {}".format(type(exc).__name__, url))
+        return False
+    if student_output != expected:
+        print("incorrect output for {}".format(path))
+        return False
+    if reuse and (timing is None or not timing.reused):
+        print("new connection for {}, expected a kept-alive one".format(path))
+        return False
+    print("correct output for {}".format(path))
+    return True
+
+
+def run_cases():
+    '''
+    run every case twice, the second time checking that each request
+    goes over the connection the one before left in the pool
+    '''
+    server, base = start()
+    try:
+        results = [compare_output(base, path, expected)
+                   for path, expected in TEST_CASES]
+        previous = TEST_CASES[-1][0]
+        for path, expected in TEST_CASES:
+            results.append(compare_output(
+                base, path, expected,
+                reuse=not previous.startswith('/close')))
+            previous = path
+        return results
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_local_cases():
+    '''
+    entry point for pytest
+    '''
+    assert all(run_cases())
+
+
+def main(args):  # pylint: disable=unused-argument
+    sys.exit(0 if all(run_cases()) else 1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
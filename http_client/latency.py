@@ -0,0 +1,126 @@
+"""
+per-phase timing of HTTP requests and latency histograms across a batch
+"""
+import bisect
+import time
+
+PHASES = ("dns", "connect", "tls", "ttfb", "transfer", "total")
+
+
+class Timing:
+    """
+    time.monotonic() timestamps of the phases of one request. Phases a
+    reused connection or a cache hit skipped stay None.
+    """
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.dns_done = None
+        self.connect_done = None
+        self.tls_done = None
+        self.sent = None  # request written to the socket
+        self.first_byte = None  # first byte of the response received
+        self.end = None  # last byte of the body received
+        self.bytes_received = 0
+        self.recv_calls = 0
+        self.reused = False  # went out on a pooled keep-alive connection
+        self.from_cache = False
+
+    def mark(self, phase):
+        """
+        record that phase (an attribute name) ended now
+        """
+        setattr(self, phase, time.monotonic())
+
+    def received(self, n):
+        """
+        count one recv call that returned n bytes
+        """
+        if n and self.first_byte is None:
+            self.first_byte = time.monotonic()
+        self.recv_calls += 1
+        self.bytes_received += n
+
+    def phases(self):
+        """
+        return {phase: seconds} for the phases this request went through
+        """
+        durations = {}
+        last = self.start
+        for phase, stamp in (("dns", self.dns_done),
+                             ("connect", self.connect_done),
+                             ("tls", self.tls_done)):
+            if stamp is not None:
+                durations[phase] = stamp - last
+                last = stamp
+        if self.first_byte is not None:
+            durations["ttfb"] = self.first_byte - (self.sent or last)
+            if self.end is not None:
+                durations["transfer"] = self.end - self.first_byte
+        if self.end is not None:
+            durations["total"] = self.end - self.start
+        return durations
+
+    def __repr__(self):
+        phases = ", ".join(f"{phase}={seconds * 1000:.1f}ms"
+                           for phase, seconds in self.phases().items())
+        return (f"Timing({phases}, bytes={self.bytes_received}, "
+                f"recvs={self.recv_calls}, reused={self.reused})")
+
+
+# bucket upper bounds in seconds: 0.1 ms to ~100 s, four per doubling
+BUCKETS = tuple(0.0001 * 2 ** (i / 4) for i in range(81))
+
+
+class LatencyHistogram:
+    """
+    log-scaled histogram of each phase across many requests. Pass add as
+    the timing_hook of an HTTPClient to collect a batch.
+    """
+
+    def __init__(self):
+        self.counts = {phase: [0] * (len(BUCKETS) + 1) for phase in PHASES}
+        self.requests = 0
+        self.bytes_received = 0
+        self.recv_calls = 0
+
+    def add(self, timing):
+        """
+        count the phases of one Timing
+        """
+        self.requests += 1
+        self.bytes_received += timing.bytes_received
+        self.recv_calls += timing.recv_calls
+        for phase, seconds in timing.phases().items():
+            self.counts[phase][bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def percentile(self, phase, q):
+        """
+        return the upper bound of the bucket holding the q-th percentile
+        (0 < q <= 100) of phase, or None if no request had that phase
+        """
+        counts = self.counts[phase]
+        total = sum(counts)
+        if not total:
+            return None
+        rank = total * q / 100
+        seen = 0
+        for i, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else float("inf")
+        return float("inf")
+
+    def summary(self):
+        """
+        return one line per phase with its sample count and p50/p90/p99
+        """
+        lines = []
+        for phase in PHASES:
+            samples = sum(self.counts[phase])
+            if samples:
+                p50, p90, p99 = (self.percentile(phase, q) * 1000
+                                 for q in (50, 90, 99))
+                lines.append(f"{phase:>8}: n={samples} p50<={p50:.1f}ms "
+                             f"p90<={p90:.1f}ms p99<={p99:.1f}ms")
+        return "\n".join(lines)
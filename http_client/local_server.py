@@ -0,0 +1,130 @@
+"""
+local HTTP server for offline tests and benchmarks of the hw1 client.
+
+    /size/<n>      n bytes framed by Content-Length
+    /chunked/<n>   n bytes in chunked encoding, chunks of varying size
+    /drip/<n>      n bytes sent a few at a time with pauses in between
+    /close/<n>     n bytes with no framing, the body ends at EOF
+    /gzip/<n>      n bytes gzip encoded if the client accepts it
+    /redirect      301 to /size/10
+    anything else  404
+
+Every body is body_for(n), so clients can check what they got.
+"""
+import gzip
+import http.server
+import socketserver
+import sys
+import threading
+import time
+
+PATTERN = bytes(range(256)) * 256  # 64 KiB
+
+
+def body_for(n):
+    """
+    the n bytes every route serves
+    """
+    repeats = -(-n // len(PATTERN))
+    return (PATTERN * repeats)[:n]
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """
+    serves the routes listed in the module docstring over keep-alive
+    HTTP/1.1
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # head and body are separate writes
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def _send(self, status, body, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_HEAD(self):  # pylint: disable=invalid-name
+        self.do_GET()
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        route, _, size = self.path.strip("/").partition("/")
+        try:
+            n = int(size) if size else 0
+        except ValueError:
+            route = "missing"
+        if route == "size":
+            self._send(200, body_for(n))
+        elif route == "chunked":
+            self._chunked(body_for(n))
+        elif route == "drip":
+            self._drip(body_for(n))
+        elif route == "close":
+            self.send_response(200)
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(body_for(n))
+            self.close_connection = True
+        elif route == "gzip":
+            if "gzip" in self.headers.get("Accept-Encoding", ""):
+                self._send(200, gzip.compress(body_for(n)),
+                           [("Content-Encoding", "gzip")])
+            else:
+                self._send(200, body_for(n))
+        elif route == "redirect":
+            self._send(301, b"", [("Location", "/size/10")])
+        else:
+            self._send(404, b"not found")
+
+    def _chunked(self, body):
+        self.send_response(200)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        pos, step = 0, 1
+        while pos < len(body):
+            chunk = body[pos:pos + step]
+            self.wfile.write(b"%x\r\n" % len(chunk) + chunk + b"\r\n")
+            pos += len(chunk)
+            step = step * 7 % 65521 + 1  # odd sizes to split reads
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _drip(self, body):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.flush()
+        for pos in range(0, len(body), 7):
+            self.wfile.write(body[pos:pos + 7])
+            self.wfile.flush()
+            time.sleep(0.001)
+
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    one thread per connection, threads do not keep the process alive
+    """
+
+    daemon_threads = True
+
+
+def start(port=0):
+    """
+    serve on 127.0.0.1:port in a background thread, return (server,
+    base url)
+    """
+    server = Server(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    SERVER = Server(("127.0.0.1", int(sys.argv[1]) if len(sys.argv) > 1
+                     else 0), Handler)
+    print(f"http://127.0.0.1:{SERVER.server_address[1]}", flush=True)
+    SERVER.serve_forever()
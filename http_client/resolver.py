@@ -0,0 +1,181 @@
+"""
+TTL-aware hostname cache and Happy Eyeballs (RFC 8305) connect
+"""
+import collections
+import errno
+import os
+import selectors
+import socket
+import threading
+import time
+
+DEFAULT_TTL = 60  # seconds, for lookups that do not report a TTL
+CONNECTION_ATTEMPT_DELAY = 0.25  # RFC 8305 section 5 recommends 250 ms
+
+
+def system_lookup(host):
+    """
+    resolve host with getaddrinfo, return ([(family, address)], ttl). The
+    system resolver does not report TTLs, so DEFAULT_TTL is used.
+    """
+    infos = socket.getaddrinfo(host, None, socket.AF_UNSPEC,
+                               socket.SOCK_STREAM)
+    addresses = []
+    for family, _, _, _, sockaddr in infos:
+        if (family, sockaddr[0]) not in addresses:
+            addresses.append((family, sockaddr[0]))
+    return addresses, DEFAULT_TTL
+
+
+def dnspython_lookup(host):
+    """
+    resolve host with dnspython's stub resolver, which reports the TTL of
+    the A and AAAA records. Needs the dnspython package.
+    """
+    import dns.exception  # pylint: disable=import-outside-toplevel
+    import dns.resolver  # pylint: disable=import-outside-toplevel
+
+    addresses = []
+    ttl = None
+    for rdtype, family in (("AAAA", socket.AF_INET6), ("A", socket.AF_INET)):
+        try:
+            answer = dns.resolver.resolve(host, rdtype)
+        except dns.exception.DNSException:
+            continue
+        ttl = answer.rrset.ttl if ttl is None else min(ttl, answer.rrset.ttl)
+        addresses.extend((family, rdata.address) for rdata in answer)
+    if not addresses:
+        raise socket.gaierror(socket.EAI_NONAME, f"no address for {host}")
+    return addresses, ttl
+
+
+class CachingResolver:
+    """
+    remembers the addresses of up to max_entries hosts for their TTL.
+    HTTPClient accepts any resolver with the same resolve and forget.
+    lookup is any function host -> ([(family, address)], ttl), such as
+    system_lookup or dnspython_lookup.
+    """
+
+    def __init__(self, lookup=system_lookup, max_entries=1024):
+        self.lookup = lookup
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._cache = collections.OrderedDict()  # host -> (expires, addresses)
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port):
+        """
+        return [(family, sockaddr)] to connect to host:port
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(host)
+            if entry is not None and entry[0] > now:
+                self._cache.move_to_end(host)
+                self.hits += 1
+                addresses = entry[1]
+            else:
+                addresses = None
+        if addresses is None:
+            self.misses += 1
+            addresses, ttl = self.lookup(host)
+            with self._lock:
+                self._cache[host] = (now + ttl, addresses)
+                self._cache.move_to_end(host)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        return [(family, (address, port) if family == socket.AF_INET
+                 else (address, port, 0, 0))
+                for family, address in addresses]
+
+    def forget(self, host):
+        """
+        drop host, e.g. after none of its addresses accepted a connection
+        """
+        with self._lock:
+            self._cache.pop(host, None)
+
+
+def interleave(addresses):
+    """
+    alternate address families, IPv6 first (RFC 8305 section 4)
+    """
+    families = collections.OrderedDict()
+    for family, sockaddr in sorted(addresses,
+                                   key=lambda a: a[0] != socket.AF_INET6):
+        families.setdefault(family, collections.deque()).append(
+            (family, sockaddr))
+    ordered = []
+    while families:
+        for family in list(families):
+            ordered.append(families[family].popleft())
+            if not families[family]:
+                del families[family]
+    return ordered
+
+
+def connect_error(err, sockaddr):
+    """
+    return the exception for a failed connect, OSError picks the subclass
+    such as ConnectionRefusedError from the errno
+    """
+    return OSError(err, f"{os.strerror(err)} ({sockaddr[0]})")
+
+
+def connect_happy_eyeballs(addresses, timeout,
+                           delay=CONNECTION_ATTEMPT_DELAY):
+    """
+    race TCP connects to addresses, starting the next attempt every delay
+    seconds (or as soon as one fails), and return the first socket that
+    connects. The others are closed.
+    """
+    addresses = interleave(addresses)
+    deadline = time.monotonic() + timeout
+    selector = selectors.DefaultSelector()
+    attempts = {}  # socket -> address it is connecting to
+    error = None
+    next_attempt = 0
+    try:
+        while True:
+            now = time.monotonic()
+            if addresses and (now >= next_attempt or not attempts):
+                family, sockaddr = addresses.pop(0)
+                try:
+                    s = socket.socket(family, socket.SOCK_STREAM)
+                except OSError as exc:  # e.g. no IPv6 on this host
+                    error = exc
+                    continue
+                s.setblocking(False)
+                err = s.connect_ex(sockaddr)
+                if err in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    selector.register(s, selectors.EVENT_WRITE)
+                    attempts[s] = sockaddr
+                    next_attempt = now + delay
+                else:
+                    error = connect_error(err, sockaddr)
+                    s.close()
+                continue
+            if not attempts:
+                raise error or OSError("no addresses to connect to")
+            if now >= deadline:
+                raise socket.timeout("timed out")
+            wait = deadline - now
+            if addresses:
+                wait = min(wait, next_attempt - now)
+            for key, _ in selector.select(max(wait, 0)):
+                s = key.fileobj
+                selector.unregister(s)
+                sockaddr = attempts.pop(s)
+                err = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if not err:
+                    s.setblocking(True)
+                    return s
+                error = connect_error(err, sockaddr)
+                s.close()
+                next_attempt = 0  # start the next attempt right away
+    finally:
+        for s in attempts:
+            s.close()
+        selector.close()
@@ -0,0 +1,101 @@
+"""
+parallel segmented (Range) downloads into a memory-mapped file
+"""
+import collections
+import concurrent.futures
+import mmap
+import sys
+import time
+
+from hw1 import HTTPClient, ProtocolError
+
+DownloadResult = collections.namedtuple(
+    "DownloadResult", "status size seconds segments")
+
+IDENTITY = {"Accept-Encoding": "identity"}  # byte ranges of the raw body
+
+
+def mb_per_sec(result):
+    """
+    aggregate throughput of a DownloadResult
+    """
+    return result.size / max(result.seconds, 1e-9) / 1e6
+
+
+def split_ranges(size, segments):
+    """
+    return [(first, last)] inclusive byte ranges covering size bytes
+    """
+    step = -(-size // segments)
+    return [(first, min(first + step, size) - 1)
+            for first in range(0, size, step)]
+
+
+def fetch_range(client, url, mm, first, last):
+    """
+    GET bytes first..last of url and write them at their offset in mm,
+    return False if the server ignored the Range header
+    """
+    headers = dict(IDENTITY, Range=f"bytes={first}-{last}")
+    with client.stream(url, headers=headers) as response:
+        content_range = response.headers.get("content-range", "")
+        if (response.status != 206
+                or not content_range.startswith(f"bytes {first}-{last}/")):
+            return False
+        pos = first
+        for piece in response.iter_body():
+            if pos + len(piece) > last + 1:
+                raise ProtocolError("range response longer than requested")
+            mm[pos:pos + len(piece)] = piece
+            pos += len(piece)
+    if pos != last + 1:
+        raise ProtocolError("range response shorter than requested")
+    return True
+
+
+def download_segmented(url, path, connections=4, min_segment=1024 * 1024,
+                       client=None):
+    """
+    download url to path over up to connections parallel Range requests,
+    or over one stream if the server does not support ranges. return a
+    DownloadResult; only a 200 leaves the body in path, otherwise path is
+    left empty
+    """
+    client = client or HTTPClient(max_idle_per_host=connections)
+    start = time.monotonic()
+    head = client.request(url, "HEAD", IDENTITY)
+    try:
+        size = int(head.headers.get("content-length", ""))
+    except ValueError:
+        size = 0
+    ranged = (head.status == 200 and size > min_segment
+              and head.headers.get("accept-ranges", "").lower() == "bytes")
+    if ranged:
+        ranges = split_ranges(size, min(connections, -(-size // min_segment)))
+        with open(path, "w+b") as f:
+            f.truncate(size)
+            with mmap.mmap(f.fileno(), size) as mm, \
+                    concurrent.futures.ThreadPoolExecutor(len(ranges)) as pool:
+                futures = [pool.submit(fetch_range, client, url, mm, *r)
+                           for r in ranges]
+                ranged = all(future.result() for future in futures)
+        if ranged:
+            return DownloadResult(head.status, size,
+                                  time.monotonic() - start, len(ranges))
+    # fall back to a single stream; any other status leaves path empty
+    with open(path, "wb") as f, client.stream(url) as response:
+        for piece in response.iter_body():
+            if response.status == 200:
+                f.write(piece)
+        size = f.tell()
+    return DownloadResult(response.status, size, time.monotonic() - start, 1)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python segmented.py <url> <output file>")
+        sys.exit(1)
+    result = download_segmented(sys.argv[1], sys.argv[2])
+    print(f"{result.status}: {result.size} bytes in {result.seconds:.2f} s "
+          f"over {result.segments} connection(s), "
+          f"{mb_per_sec(result):.1f} MB/s")
@@ -1,5 +1,7 @@
 import socket
 import sys
+from war_protocol import (GAME_START, PLAY_CARD, PLAY_RESULT, WANT_GAME,
+                          Decoder, Encoder, receive)
 
 
 def main():
@@ -18,41 +20,39 @@ def main():
 
     # Connect to the server on the local computer
     s.connect((host, port))
+    decoder = Decoder()
+    encoder = Encoder()
 
     # Send the "want game" message (command = 0, payload = 0)
-    want_game_msg = bytes([0, 0])
-    s.send(want_game_msg)
+    encoder.add(WANT_GAME, 0)
+    encoder.flush(s)
     print("Sent 'want game' message to server")
 
     # Receive the "game start" message from the server
-    game_start_packet = s.recv(1024)
-
-    # The first byte is the command, and the rest is the card payload
-    command = game_start_packet[0]
-    if command == 1:  # Check if this is the "game start" command
-        cards = list(game_start_packet[1:])  # Extract the card payload
-        print("Received 'game start' message with cards:", cards)
-    else:
+    message = receive(s, decoder)
+    if message is None or message[0] != GAME_START:
         print("Unexpected command received from server")
+        s.close()
+        return
+    cards = list(message[1])  # the card payload
+    print("Received 'game start' message with cards:", cards)
 
-    for _ in range(26):
-        # Calculate and print the current round number
-        current_round = 26 - len(cards) + 1
+    for current_round, card in enumerate(cards, 1):
         print(f"Round {current_round}")
 
-        # Get the current card and remove it from the list
-        card = cards.pop(0)
-
-        play_card = bytes([2, card])
-        s.send(play_card)
+        # Send one card, then wait for the result of the round
+        encoder.add(PLAY_CARD, card)
+        encoder.flush(s)
         print(f"Sent card {card} to the server")
 
         # Receive the round result from the server
-        round_result = s.recv(2)
-        result_command = round_result[0]
-        result = round_result[1]
+        message = receive(s, decoder)
+        if message is None:
+            print("Server closed the connection")
+            break
+        result_command, result = message
 
-        if result_command == 3:  # Command 3 represents "play result"
+        if result_command == PLAY_RESULT:
             if result == 0:
                 print(f"Round {current_round} result: Win")
             elif result == 1:
@@ -1,138 +1,322 @@
+"""
+war-server.py: a server for the card game war, run until interrupted.
+
+Clients that send "want game" are paired two by two into games, each with
+its own Game object. One thread runs a selectors loop over every socket,
+so thousands of games at the same time start no threads, and a game that
+ends on an invalid card or a lost client leaves all the others alone.
+"""
+
+import random
+import selectors
 import socket
 import sys
-import random
-from threading import Barrier, Thread, Condition
+import time
+from war_protocol import (DRAW, GAME_START, HAND_SIZE, LOSE, PLAY_CARD,
+                          PLAY_RESULT, WANT_GAME, WIN, Decoder, Encoder,
+                          message_length)
 
-# Initialize a Barrier and Condition
-barrier = Barrier(2)
-condition = Condition()
-game_active = True
+MAX_OUTPUT = 64 * 1024  # unsent bytes before a client is dropped
+# unhandled bytes before a client is dropped: a player has at most its
+# whole hand of cards waiting for its opponent
+MAX_INPUT = message_length(PLAY_CARD) * HAND_SIZE
+IDLE_TIMEOUT = 30  # seconds a client may stay quiet while it is owed a move
 
-# Shared dictionary to store cards received from each client
-round_cards = {}
 
-
-def thr_join():
+class Player:
     """
-    Join main thread
+    a client connection: messages read but not handled yet, messages not
+    sent yet, and the game it is in and its index there once paired
     """
-    condition.acquire()
-    while game_active and len(round_cards) < 2:
-        condition.wait()
-    condition.release()
+
+    def __init__(self, sock: socket.socket, address):
+        self.sock = sock
+        self.address = address
+        self.input = Decoder()
+        self.output = Encoder()
+        self.game = None
+        self.index = None
+        self.closed = False
+        self.last_active = time.monotonic()
 
 
-def compare_and_send_results(client1, client2):
+class Game:
     """
-    Compare cards
+    one game between two players: the round being played and the card
+    each player played in it so far
     """
-    # Extract the cards
-    card1 = round_cards[0]
-    card2 = round_cards[1]
 
-    rank1 = card1 % 13 + 2
-    rank2 = card2 % 13 + 2
-
-    # Compare cards and determine results
-    if rank1 > rank2:
-        result_client1, result_client2 = 0, 2  # Client 1 wins, Client 2 loses
-    elif rank1 < rank2:
-        result_client1, result_client2 = 2, 0  # Client 1 loses, Client 2 wins
-    else:
-        result_client1, result_client2 = 1, 1  # Draw for both clients
-
-    # Send results to both clients
-    client1.send(bytes([3, result_client1]))
-    client2.send(bytes([3, result_client2]))
-
-    print(
-        f"Sent result to client 1: {'Win' if result_client1 == 0 else 'Draw' if result_client1 == 1 else 'Lose'}"
-    )
-    print(
-        f"Sent result to client 2: {'Win' if result_client2 == 0 else 'Draw' if result_client2 == 1 else 'Lose'}"
-    )
-
-    # Clear round_cards for the next round
-    round_cards.clear()
+    def __init__(self, number: int, players):
+        self.number = number
+        self.players = players
+        self.round = 1
+        self.cards = [None, None]
+        self.over = False
 
 
 def validation(card):
     """
     Validate if cards are in range (0 - 51)
     """
-    global game_active
-    if card > 51 or card < 0:
-        game_active = False
-        print("\033[91mInvalid card, game stop\033[0m")
-        return False
-    return True
+    return 0 <= card <= 51
 
 
-# Thread function to handle game setup and communication for each client
-def threaded(client, client_id, cards):
+def results(card1, card2):
     """
-    Client thread
+    the PLAY_RESULT payloads for the two players of a round
     """
-    # Wait until both clients have reached this point
-    barrier.wait()
+    rank1 = card1 % 13 + 2
+    rank2 = card2 % 13 + 2
+    if rank1 > rank2:
+        return WIN, LOSE
+    if rank1 < rank2:
+        return LOSE, WIN
+    return DRAW, DRAW
 
-    # Send "game start" command with cards
-    try:
-        game_start_command = bytes([1])  # Assuming "1" is the game start command
-        payload = bytes(cards)  # Convert the list of cards to bytes
-        client.send(game_start_command + payload)
-        print(f"Sent 'game start' message with cards: {cards}")
-    except Exception as e:
-        print(f"Error sending data to client: {e}")
-        client.close()
-        return
-
-    # Keep the client connection open if additional interaction is needed
-    while True:
-        try:
-            data = client.recv(2)  # Expect more messages from client
-            if not data:
-                print("Client disconnected.")
-                break
-            command = data[0]
-            card_played = data[1]
-            print(f"Client {client_id+1} played card: {card_played}")
-        except Exception as e:
-            print(f"Error receiving data from client: {e}")
-            break
-
-        if not validation(card_played):
-            condition.acquire()
-            condition.notify()
-            condition.release()
-            break
-
-        if command == 2:
-            condition.acquire()
-            round_cards[client_id] = card_played
-            if len(round_cards) >= 2:
-                condition.notify()
-            condition.release()
-
-    # Connection closed
-    client.close()
-
-
-def check():
+
+class WarServer:
     """
-    Check condition
+    accepts players on port of host and runs their games
     """
-    if not game_active:
-        print("\033[91mGame ended due to invalid card\033[0m")
-        return False
-    return True
+
+    def __init__(self, host: str, port: int):
+        self.games = 0  # games started
+        self.playing = set()  # games not over yet
+        self.waiting = None  # a player who wants a game and has no opponent
+        self._players = set()
+        self._unflushed = set()  # players with output queued this turn
+        self._selector = selectors.DefaultSelector()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(socket.SOMAXCONN)
+        self.sock.setblocking(False)
+        self._selector.register(self.sock, selectors.EVENT_READ,
+                                self._accept)
+
+    def serve_forever(self):
+        """
+        pair players and run their games until interrupted
+        """
+        last_idle_check = time.monotonic()
+        while True:
+            for key, mask in self._selector.select(timeout=1.0):
+                key.data(key.fileobj, mask)
+            # one write per player for all it was sent this turn
+            while self._unflushed:
+                self._flush(self._unflushed.pop())
+            now = time.monotonic()
+            if now - last_idle_check >= 1.0:
+                self._close_idle(now)
+                last_idle_check = now
+
+    def close(self):
+        for player in list(self._players):
+            self._close(player)
+        self.sock.close()
+        self._selector.close()
+
+    def _accept(self, sock, _mask):
+        try:
+            conn, address = sock.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as error:
+            print(f"Cannot accept client: {error}")
+            return
+        conn.setblocking(False)
+        player = Player(conn, address)
+        self._players.add(player)
+        self._selector.register(conn, selectors.EVENT_READ,
+                                lambda _sock, mask: self._event(player, mask))
+
+    def _event(self, player: Player, mask):
+        """
+        read the messages of player, or send it more output
+        """
+        if mask & selectors.EVENT_WRITE:
+            self._flush(player)
+        if not mask & selectors.EVENT_READ or player.closed:
+            return
+        try:
+            data = player.sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._disconnected(player)
+            return
+        player.last_active = time.monotonic()
+        player.input.feed(data)
+        self._parse(player)
+        if len(player.input) > MAX_INPUT and not player.closed:
+            if player.game is None:
+                self._close(player)
+            else:
+                self._end(player.game, f"player {player.index + 1} sent "
+                                       "too much ahead")
+
+    def _parse(self, player: Player):
+        """
+        handle the whole messages in the input of player, except those
+        past the card it played this round: they wait for its opponent
+        """
+        while not player.closed:
+            game = player.game
+            if game is not None and game.cards[player.index] is not None:
+                return
+            message = player.input.next_message()
+            if message is None:
+                return
+            self._message(player, *message)
+
+    def _message(self, player: Player, command, payload):
+        if player.game is None:
+            if command != WANT_GAME or payload != 0 or player is self.waiting:
+                print(f"Invalid message from {player.address[0]}:"
+                      f"{player.address[1]}, disconnecting client")
+                self._close(player)
+            elif self.waiting is None:
+                self.waiting = player
+            else:
+                opponent, self.waiting = self.waiting, None
+                self._start(opponent, player)
+            return
+        game = player.game
+        if command != PLAY_CARD:
+            self._end(game, f"unexpected command {command} from player "
+                            f"{player.index + 1}")
+            return
+        if not validation(payload):
+            self._end(game, f"\033[91mInvalid card {payload}, game stop"
+                            "\033[0m")
+            return
+        game.cards[player.index] = payload
+        if None not in game.cards:
+            self._round(game)
+
+    def _start(self, player1: Player, player2: Player):
+        """
+        deal a shuffled deck to two players who want a game
+        """
+        self.games += 1
+        game = Game(self.games, (player1, player2))
+        self.playing.add(game)
+        deck = list(range(52))
+        random.shuffle(deck)
+        for index, player in enumerate(game.players):
+            player.game = game
+            player.index = index
+            self._send(player, GAME_START,
+                       deck[index * HAND_SIZE:(index + 1) * HAND_SIZE])
+        print(f"Game {game.number} start, {len(self.playing)} games "
+              "in progress")
+
+    def _round(self, game: Game):
+        """
+        both cards of the round are in: send each player its result
+        """
+        for player, result in zip(game.players, results(*game.cards)):
+            self._send(player, PLAY_RESULT, result)
+        game.cards = [None, None]
+        game.round += 1
+        if game.round > HAND_SIZE:
+            self._end(game, "game over")
+            return
+        for player in game.players:
+            self._parse(player)
+
+    def _end(self, game: Game, reason: str):
+        """
+        finish game, closing both of its players
+        """
+        if game.over:
+            return
+        game.over = True
+        self.playing.discard(game)
+        print(f"Game {game.number} ended after {game.round - 1} rounds: "
+              f"{reason}")
+        for player in game.players:
+            self._close(player)
+
+    def _disconnected(self, player: Player):
+        if player.game is None:
+            self._close(player)
+        else:
+            self._end(player.game, f"player {player.index + 1} disconnected")
+
+    def _close_idle(self, now: float):
+        """
+        drop clients quiet for IDLE_TIMEOUT that the server is waiting for:
+        before they ask for a game, or for their card of the round. A
+        player waiting for an opponent is left alone.
+        """
+        for player in list(self._players):
+            if player.closed or now - player.last_active <= IDLE_TIMEOUT:
+                continue
+            game = player.game
+            if game is None:
+                if player is not self.waiting:
+                    self._close(player)
+            elif game.cards[player.index] is None:
+                self._end(game, f"player {player.index + 1} timed out")
+
+    def _send(self, player: Player, command, payload):
+        """
+        queue a message to player, sent at the end of the loop's turn
+        """
+        player.output.add(command, payload)
+        self._unflushed.add(player)
+
+    def _flush(self, player: Player):
+        """
+        send what player can take now, wait for it to be writable for the
+        rest
+        """
+        if player.closed:
+            return
+        try:
+            player.output.send(player.sock)
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self._disconnected(player)
+            return
+        if len(player.output) > MAX_OUTPUT:
+            self._disconnected(player)
+            return
+        events = selectors.EVENT_READ
+        if player.output:
+            events |= selectors.EVENT_WRITE
+        key = self._selector.get_key(player.sock)
+        if key.events != events:
+            self._selector.modify(player.sock, events, key.data)
+
+    def _close(self, player: Player):
+        """
+        close player, first sending what it is still owed if that can be
+        done right away
+        """
+        if player.closed:
+            return
+        player.closed = True
+        self._players.discard(player)
+        if self.waiting is player:
+            self.waiting = None
+        if player.output:
+            try:
+                player.output.send(player.sock)
+            except OSError:
+                pass
+        self._selector.unregister(player.sock)
+        player.sock.close()
 
 
 def main():
     """
     main thread for server
     """
-    global game_active
     if len(sys.argv) != 2:
         print("Usage: python war-server.py <port>")
         sys.exit(1)
@@ -140,61 +324,15 @@ def main():
     # Use the port provided by the user
     port = int(sys.argv[1])
     host = "127.0.0.1"
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.bind((host, port))
+    server = WarServer(host, port)
     print("Socket bound to port", port)
-
-    # Put the socket into listening mode
-    s.listen(2)
-    print("Socket is listening for two connections")
-
-    clients = []
-
-    # Accept connections until two clients connect and send the "want game" message
-    while len(clients) < 2:
-        client, addr = s.accept()
-        print("Connected to:", addr[0], ":", addr[1])
-
-        # Receive and verify the "want game" message
-        want_game = client.recv(2)
-        if want_game == bytes([0, 0]):
-            print("Received valid 'want game' message from client")
-            clients.append(client)
-        else:
-            print("Invalid message received, disconnecting client")
-            client.close()
-
-    # Shuffle and deal cards once both clients have connected and been verified
-    deck = list(range(52))  # Standard deck of 52 cards
-    random.shuffle(deck)  # Shuffle the deck
-    player1_cards = deck[:26]  # First 26 cards for player 1
-    player2_cards = deck[26:]  # Last 26 cards for player 2
-
-    # Start a new thread for each client and explicitly assign their cards
-    thread1 = Thread(target=threaded, args=(clients[0], 0, player1_cards))
-    thread2 = Thread(target=threaded, args=(clients[1], 1, player2_cards))
-
-    thread1.start()
-    thread2.start()
-
-    # Main loop for managing rounds
-    for i in range(26):
-        if not check():
-            break
-        print(f"Round {i+1} start")
-        thr_join()  # Wait for both cards to be played
-        if not check():
-            break
-        compare_and_send_results(clients[0], clients[1])
-        print(f"Round {i+1} end\r\n")
-
-    # Join threads to keep the server running until both clients are finished
-    thread1.join()
-    thread2.join()
-
-    # Close the server socket
-    s.close()
-    print("Server socket closed. Game over.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        print(f"Server socket closed. {server.games} games played.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,137 @@
+"""
+war_protocol.py: the messages war-client.py and war-server.py exchange.
+
+Every message is a command byte and its payload: one byte, except for
+GAME_START, which carries the HAND_SIZE cards dealt to the client. TCP
+does not keep message boundaries, so a read may hold several messages or
+part of one; a Decoder takes the bytes as they come and hands back whole
+messages, and an Encoder collects messages to send them in one write.
+"""
+
+import socket
+
+# commands
+WANT_GAME = 0  # client: payload 0
+GAME_START = 1  # server: the HAND_SIZE cards of the client
+PLAY_CARD = 2  # client: a card, 0 - 51
+PLAY_RESULT = 3  # server: WIN, DRAW or LOSE
+
+# payloads of PLAY_RESULT
+WIN = 0
+DRAW = 1
+LOSE = 2
+
+HAND_SIZE = 26  # every player is dealt half the deck
+
+
+def message_length(command: int) -> int:
+    """
+    bytes in a message with command, the command byte included
+    """
+    return 1 + HAND_SIZE if command == GAME_START else 2
+
+
+class Decoder:
+    """
+    splits a byte stream into messages: feed() it whatever was read and
+    take (command, payload) pairs from next_message() or by iterating.
+    The payload of GAME_START is the bytes of the cards, any other is an
+    int.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self._pos = 0  # start of the first message not handed out yet
+
+    def __len__(self):
+        """
+        bytes received and not handed out as messages yet
+        """
+        return len(self.buffer) - self._pos
+
+    def __iter__(self):
+        while True:
+            message = self.next_message()
+            if message is None:
+                return
+            yield message
+
+    def feed(self, data: bytes):
+        if self._pos:  # drop handed out messages once per read, not each
+            del self.buffer[:self._pos]
+            self._pos = 0
+        self.buffer += data
+
+    def next_message(self):
+        """
+        return the next whole (command, payload), or None until more bytes
+        are fed
+        """
+        if len(self.buffer) - self._pos < 2:
+            return None
+        command = self.buffer[self._pos]
+        end = self._pos + message_length(command)
+        if end > len(self.buffer):
+            return None
+        if command == GAME_START:
+            payload = bytes(self.buffer[self._pos + 1:end])
+        else:
+            payload = self.buffer[self._pos + 1]
+        self._pos = end
+        return command, payload
+
+
+class Encoder:
+    """
+    messages waiting to be sent, so that many go out in one write
+    """
+
+    def __init__(self):
+        self.output = bytearray()
+
+    def __len__(self):
+        return len(self.output)
+
+    def add(self, command: int, payload):
+        """
+        queue a message; payload is an int, or the cards of GAME_START
+        """
+        self.output.append(command)
+        if command == GAME_START:
+            self.output += bytes(payload)
+        else:
+            self.output.append(payload)
+
+    def send(self, sock: socket.socket) -> int:
+        """
+        send as much as the non-blocking sock takes, return the bytes sent
+        """
+        sent = sock.send(self.output)
+        del self.output[:sent]
+        return sent
+
+    def flush(self, sock: socket.socket):
+        """
+        send everything queued on the blocking sock
+        """
+        sock.sendall(self.output)
+        self.output.clear()
+
+
+def receive(sock: socket.socket, decoder: Decoder):
+    """
+    return the next message from the blocking sock, reading only when
+    decoder has no whole message left, or None once sock is closed or
+    reset
+    """
+    while True:
+        message = decoder.next_message()
+        if message is not None:
+            return message
+        try:
+            data = sock.recv(4096)
+        except ConnectionResetError:
+            data = b""
+        if not data:
+            return None
+        decoder.feed(data)